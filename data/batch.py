@@ -1,16 +1,102 @@
+from typing import Callable, Optional, Iterator, Any, Tuple, List, Sequence
+
+import warnings
+from collections import deque
+from functools import partial
+from itertools import islice, chain
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
 import numpy as np
 import torch
 
 class BatchGenerator:
+    """Yields batches of x (and y) of size bsize, epoch after epoch over permutations of the data.
+
+    With num_workers > 0, batches are assembled ahead of time by a pool of worker threads (or
+    processes if use_processes is True) and at most prefetch batches are in flight. Threads are
+    enough when the gather releases the GIL (numpy arrays of numbers); processes receive x and y
+    once, when they start, and need a picklable collate_fn.
+
+    Parameters
+    ----------
+    x : array_like
+        the inputs, indexed with an array of indices.
+    y : array_like
+        the optional targets.
+    bsize : int
+        the batch size.
+    seed : int
+        the seed of the permutation.
+    num_workers : int
+        the number of workers preparing batches, 0 to build them on the consumer thread.
+    prefetch : int
+        the maximum number of batches prepared ahead of the consumer.
+    use_processes : bool
+        True to prepare batches in worker processes instead of threads.
+    collate_fn : Callable
+        applied to every batch, either x_batch or (x_batch, y_batch), in the worker.
+    pin_memory : bool
+        True to convert the arrays of every batch to page-locked torch tensors, which makes
+        copies to the GPU faster and lets them be asynchronous.
+    shuffle_epochs : bool
+        True to draw a new permutation for every epoch from a private np.random.Generator, instead
+        of reusing the one drawn at construction with the global np.random.seed.
+    drop_last : bool
+        True to drop the last incomplete batch of an epoch, False to complete it with the first
+        samples of the same epoch (wrap-around), so every sample is seen once per epoch.
+    contiguous : bool
+        True to gather x (and y) in epoch order into preallocated buffers once per epoch, so
+        batches are slice views instead of fancy-index copies. A batch is only valid until the
+        next epoch starts overwriting the buffers, and it cannot be combined with num_workers.
+    indices : array_like
+        the indices of the samples of x (and y) to draw batches from, e.g. one side of a split
+        from data.split. All samples by default.
+    """
 
-    def __init__(self, x, y=None, bsize=16, seed=10):
+    def __init__(self, x, y=None, bsize=16, seed=10, num_workers: int = 0, prefetch: int = 2,
+                 use_processes: bool = False, collate_fn: Optional[Callable] = None,
+                 pin_memory: bool = False, shuffle_epochs: bool = False,
+                 drop_last: bool = True, contiguous: bool = False, indices=None):
         self.x = x
         self.y = y
         self.bsize = bsize
+        self.indices = np.arange(len(x)) if indices is None else np.asarray(indices)
+        self.n_samples = len(self.indices)
+        self.num_workers = num_workers
+        self.prefetch = max(prefetch, 1)
+        self.use_processes = use_processes
+        self.collate_fn = collate_fn
+        self.pin_memory = pin_memory
+        self.shuffle_epochs = shuffle_epochs
+        self.drop_last = drop_last
+        self.contiguous = contiguous
+        self.epoch = 0
 
-        np.random.seed(seed)
+        if not drop_last and bsize > self.n_samples:
+            raise ValueError(f'Batch size {bsize} is larger than the data ({self.n_samples}), '
+                             f'batches cannot wrap around')
+        if contiguous:
+            if num_workers > 0:
+                raise ValueError('Contiguous batches are views of one buffer and cannot be '
+                                 'prefetched, set num_workers=0')
+            if not all(isinstance(a, np.ndarray) for a in (x, y) if a is not None):
+                raise ValueError('Contiguous batches need x and y to be numpy arrays')
+        self._buffers = None
 
-        self.indices_org = np.random.permutation(np.arange(len(x)))
+        if shuffle_epochs:
+            self.rng = np.random.default_rng(seed)
+            self.indices_org = self.rng.permutation(self.indices)
+        else:
+            np.random.seed(seed)
+
+            self.indices_org = np.random.permutation(self.indices)
+
+    @property
+    def n_batches_per_epoch(self) -> int:
+        if self.drop_last:
+            return max(self.n_samples // self.bsize, 1)
+        return -(-self.n_samples // self.bsize)
 
     def get_items_circular(self, items, low_id, high_id):
         size = len(items)
@@ -31,15 +117,424 @@ class BatchGenerator:
                 raise ValueError(f'Unknown type for concatenation {items.__class__.__name__}')
         return items[low: high]
 
+    def _next_epoch(self) -> np.ndarray:
+        """Returns the order of the next epoch."""
+        if self.shuffle_epochs and self.epoch > 0:
+            self.indices_org = self.rng.permutation(self.indices)
+        self.epoch += 1
+        return self.indices_org
+
+    def _epoch_batches(self, tot_nbatch) -> Iterator[Tuple[np.ndarray, int]]:
+        """Yields (epoch order, start of the batch in it) for tot_nbatch batches."""
+        n_batches = self.n_batches_per_epoch
+        while tot_nbatch > 0:
+            order = self._next_epoch()
+            for chunk in range(min(n_batches, tot_nbatch)):
+                yield order, chunk * self.bsize
+            tot_nbatch -= n_batches
+
+    def _slice(self, items, start):
+        if self.drop_last:
+            return items[start:start+self.bsize]
+        return self.get_items_circular(items, start, start + self.bsize)
+
+    def _batch_indices(self, tot_nbatch) -> Iterator[np.ndarray]:
+        for order, start in self._epoch_batches(tot_nbatch):
+            yield self._slice(order, start)
+
+    def _contiguous_gen(self, tot_nbatch):
+        arrays = [a for a in (self.x, self.y) if a is not None]
+        if self._buffers is None:
+            self._buffers = [np.empty((self.n_samples,) + a.shape[1:], a.dtype) for a in arrays]
+        current = None
+        for order, start in self._epoch_batches(tot_nbatch):
+            if order is not current:
+                # one gather per epoch, the batches below are views. The order is a permutation,
+                # so no bounds check is needed, and mode='raise' would gather into a temporary.
+                for a, buf in zip(arrays, self._buffers):
+                    np.take(a, order, axis=0, out=buf, mode='clip')
+                current = order
+            batch = [self._slice(buf, start) for buf in self._buffers]
+            batch = batch[0] if self.y is None else tuple(batch)
+            yield batch if self.collate_fn is None else self.collate_fn(batch)
+
+    def _batches(self, tot_nbatch) -> Iterator[Any]:
+        if self.contiguous:
+            return self._contiguous_gen(tot_nbatch)
+        if self.num_workers > 0:
+            return self._prefetch_gen(tot_nbatch)
+        return (_make_batch(self.x, self.y, self.collate_fn, selected)
+                for selected in self._batch_indices(tot_nbatch))
+
     def get_gen(self, tot_nbatch):
-        last_off = max(len(self.indices_org) // self.bsize, 1)
-        chunk_iter = 0
-        for i in range(tot_nbatch):
-            chunk = chunk_iter % last_off
-            start = chunk * self.bsize
-            selected = self.indices_org[start:start+self.bsize]
-            chunk_iter += 1
-            if self.y is not None:
-                yield self.x[selected], self.y[selected]
+        batches = self._batches(tot_nbatch)
+        if self.pin_memory and not torch.cuda.is_available():
+            warnings.warn('pin_memory is set but CUDA is not available, batches are not pinned')
+        try:
+            for batch in batches:
+                yield _pin(batch) if self.pin_memory else batch
+        finally:
+            # stops the workers when the consumer abandons this generator
+            batches.close()
+
+    def _prefetch_gen(self, tot_nbatch):
+        if self.use_processes:
+            pool = ProcessPoolExecutor(self.num_workers, initializer=_init_worker,
+                                       initargs=(self.x, self.y, self.collate_fn))
+            submit = partial(pool.submit, _worker_batch)
+        else:
+            pool = ThreadPoolExecutor(self.num_workers)
+            submit = partial(pool.submit, _make_batch, self.x, self.y, self.collate_fn)
+
+        pending = deque()
+        indices = self._batch_indices(tot_nbatch)
+        try:
+            for selected in islice(indices, self.prefetch):
+                pending.append(submit(selected))
+            while pending:
+                batch = pending.popleft().result()
+                # keep the queue full while the consumer works on this batch
+                selected = next(indices, None)
+                if selected is not None:
+                    pending.append(submit(selected))
+                yield batch
+        finally:
+            # runs on exhaustion, on errors and when the consumer abandons the generator
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+
+
+class BlockShuffleBatchGenerator(BatchGenerator):
+    """Yields shuffled batches from sources that may not fit in memory, with sequential reads.
+
+    x and y can be numpy arrays, np.memmap (or the path of a .npy file, which is memory-mapped),
+    h5py datasets or the lazy datasets of file.read_hdf5(lazy=True). Every epoch, the rows are cut
+    into blocks of consecutive rows and the order of the blocks is shuffled. Then window_blocks
+    blocks at a time are read into memory and shuffled together. Reads stay sequential within a
+    block, and the order gets closer to a full shuffle as the window grows.
+
+    Parameters
+    ----------
+    x : Union[str, Path, array_like]
+        the inputs.
+    y : Union[str, Path, array_like]
+        the optional targets, with as many rows as x.
+    bsize : int
+        the batch size.
+    seed : int
+        the seed of the private np.random.Generator.
+    block_size : int
+        the number of rows per block. Defaults to a multiple of the HDF5 chunk length, or to the
+        number of rows in about 1 MiB.
+    window_blocks : int
+        the number of blocks shuffled together, which bounds the memory used to about
+        2 * window_blocks * block_size rows.
+    num_workers : int
+        the number of threads reading the blocks of the next window while the current window is
+        consumed, 0 to read them on the consumer thread.
+    collate_fn : Callable
+        applied to every batch, either x_batch or (x_batch, y_batch).
+    pin_memory : bool
+        see BatchGenerator.
+    drop_last : bool
+        True to drop the last incomplete batch of an epoch, False to complete it with the first
+        samples of the epoch.
+    """
+
+    def __init__(self, x, y=None, bsize=16, seed=10, block_size: Optional[int] = None,
+                 window_blocks: int = 16, num_workers: int = 0,
+                 collate_fn: Optional[Callable] = None, pin_memory: bool = False,
+                 drop_last: bool = True):
+        self.x = _open_source(x)
+        self.y = None if y is None else _open_source(y)
+        if self.y is not None and len(self.y) != len(self.x):
+            raise ValueError(f'x and y have different lengths: {len(self.x)} != {len(self.y)}')
+        if bsize > len(self.x):
+            raise ValueError(f'Batch size {bsize} is larger than the data ({len(self.x)})')
+        self.bsize = bsize
+        self.n_samples = len(self.x)
+        self.block_size = block_size or _default_block_size(self.x)
+        self.window_blocks = max(window_blocks, 1)
+        self.num_workers = num_workers
+        self.collate_fn = collate_fn
+        self.pin_memory = pin_memory
+        self.drop_last = drop_last
+        self.shuffle_epochs = True
+        self.contiguous = False
+        self.epoch = 0
+        self.rng = np.random.default_rng(seed)
+
+    def _sources(self) -> List[Any]:
+        return [a for a in (self.x, self.y) if a is not None]
+
+    def _read_block(self, block: int, window: List[np.ndarray], pos: int):
+        start = block * self.block_size
+        stop = min(start + self.block_size, len(self.x))
+        for a, out in zip(self._sources(), window):
+            out[pos:pos+stop-start] = a[start:stop]
+
+    def _read_window(self, blocks: np.ndarray, pool: Optional[ThreadPoolExecutor]):
+        """Reads the given blocks into new arrays, returns them and the futures of the reads."""
+        n = len(self.x)
+        sizes = [min(self.block_size, n - b * self.block_size) for b in blocks]
+        window = [np.empty((sum(sizes),) + a.shape[1:], a.dtype) for a in self._sources()]
+        offsets = np.cumsum([0] + sizes[:-1])
+        if pool is None:
+            for b, pos in zip(blocks, offsets):
+                self._read_block(b, window, pos)
+            return window, []
+        return window, [pool.submit(self._read_block, b, window, pos)
+                        for b, pos in zip(blocks, offsets)]
+
+    def _windows(self, pool: Optional[ThreadPoolExecutor]) -> Iterator[List[np.ndarray]]:
+        n_blocks = -(-len(self.x) // self.block_size)
+        order = self.rng.permutation(n_blocks)
+        windows = [order[i:i+self.window_blocks] for i in range(0, n_blocks, self.window_blocks)]
+        pending = self._read_window(windows[0], pool)
+        for blocks in windows[1:] + [None]:
+            window, futures = pending
+            for future in futures:
+                future.result()
+            if blocks is not None:
+                # the next window is read while this one is consumed
+                pending = self._read_window(blocks, pool)
+            yield window
+
+    def _epoch_gen(self, n_out: int) -> Iterator[Any]:
+        pool = ThreadPoolExecutor(self.num_workers) if self.num_workers > 0 else None
+        bsize = self.bsize
+        head, rest = None, None
+        try:
+            for window in self._windows(pool):
+                # batches are gathered from the in-memory window, the window is never copied
+                perm = self.rng.permutation(len(window[0]))
+                pos, carried = 0, []
+                if rest is not None:
+                    # complete the batch started in the previous window
+                    pos = min(bsize - len(rest[0]), len(perm))
+                    rest = [np.concatenate([r, a[perm[:pos]]]) for r, a in zip(rest, window)]
+                    if len(rest[0]) < bsize:
+                        continue
+                    carried = [rest]
+                starts = range(pos, len(perm) - bsize + 1, bsize)
+                full = ([a[perm[start:start+bsize]] for a in window] for start in starts)
+                for batch in chain(carried, full):
+                    if head is None:
+                        head = batch
+                    if n_out == 0:
+                        return
+                    n_out -= 1
+                    yield self._collate(batch)
+                rest_ids = perm[pos + len(starts) * bsize:]
+                rest = [a[rest_ids] for a in window] if len(rest_ids) else None
+
+            if not self.drop_last and n_out > 0 and rest is not None:
+                # wrap around to the first samples of the epoch
+                yield self._collate([np.concatenate([r, h[:bsize-len(r)]])
+                                     for r, h in zip(rest, head)])
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def _collate(self, batch: List[np.ndarray]) -> Any:
+        batch = batch[0] if self.y is None else tuple(batch)
+        return batch if self.collate_fn is None else self.collate_fn(batch)
+
+    def _batches(self, tot_nbatch) -> Iterator[Any]:
+        n_batches = self.n_batches_per_epoch
+        while tot_nbatch > 0:
+            self.epoch += 1
+            yield from self._epoch_gen(min(n_batches, tot_nbatch))
+            tot_nbatch -= n_batches
+
+
+class BucketBatchGenerator(BatchGenerator):
+    """Yields padded batches of variable-length sequences, grouped by length to reduce padding.
+
+    Every epoch, the examples are shuffled and cut into windows of window_size examples. Each
+    window is sorted by length and cut into batches of similar lengths, either bsize examples or
+    as many as fit in max_tokens (number of examples times the longest length), and the batches of
+    a window are yielded in random order.
+
+    A batch is (padded, mask) or (padded, mask, y_batch), where padded has shape
+    (batch size, longest length, ...) and mask is True on the real (non-padding) positions.
+
+    Parameters
+    ----------
+    x : Sequence
+        the sequences, anything that np.asarray turns into an array of shape (length, ...).
+    y : array_like
+        the optional targets, one per sequence.
+    bsize : int
+        the batch size, only used if max_tokens is None.
+    seed : int
+        the seed of the private np.random.Generator.
+    max_tokens : int
+        if given, the maximum number of padded positions per batch, instead of a fixed bsize. A
+        sequence longer than max_tokens gets a batch of its own.
+    window_size : int
+        the number of examples sorted together, 100 * bsize by default. Larger windows pad less
+        but make batches less random.
+    pad_value : Any
+        the value of the padding positions.
+    return_tensors : bool
+        True to return torch tensors instead of numpy arrays.
+    collate_fn : Callable
+        applied to every padded batch.
+    pin_memory : bool
+        see BatchGenerator.
+    """
+
+    def __init__(self, x, y=None, bsize=16, seed=10, max_tokens: Optional[int] = None,
+                 window_size: Optional[int] = None, pad_value: Any = 0,
+                 return_tensors: bool = False, collate_fn: Optional[Callable] = None,
+                 pin_memory: bool = False):
+        if not len(x):
+            raise ValueError('Cannot make batches of an empty x')
+        if y is not None and len(y) != len(x):
+            raise ValueError(f'x and y have different lengths: {len(x)} != {len(y)}')
+        self.x = x
+        self.y = y
+        self.bsize = bsize
+        self.max_tokens = max_tokens
+        self.window_size = window_size or 100 * bsize
+        self.pad_value = pad_value
+        self.return_tensors = return_tensors
+        self.collate_fn = collate_fn
+        self.pin_memory = pin_memory
+        self.epoch = 0
+        self.rng = np.random.default_rng(seed)
+        self.lengths = np.fromiter((len(seq) for seq in x), dtype=np.int64, count=len(x))
+
+    @property
+    def n_batches_per_epoch(self) -> Optional[int]:
+        """None with max_tokens, since the number of batches then depends on the shuffle."""
+        if self.max_tokens is not None:
+            return None
+        n_full, last = divmod(len(self.x), self.window_size)
+        return n_full * -(-self.window_size // self.bsize) + -(-last // self.bsize)
+
+    def _split(self, ids: np.ndarray) -> List[np.ndarray]:
+        """Cuts ids, sorted by length, into batches."""
+        if self.max_tokens is None:
+            return [ids[i:i+self.bsize] for i in range(0, len(ids), self.bsize)]
+        batches, start = [], 0
+        lengths = self.lengths[ids]
+        for stop in range(1, len(ids) + 1):
+            # lengths are sorted, so the last one is the longest of the batch
+            if stop - start > 1 and (stop - start) * lengths[stop - 1] > self.max_tokens:
+                batches.append(ids[start:stop - 1])
+                start = stop - 1
+        batches.append(ids[start:])
+        return batches
+
+    def _epoch_ids(self) -> Iterator[np.ndarray]:
+        order = self.rng.permutation(len(self.x))
+        for i in range(0, len(order), self.window_size):
+            window = order[i:i+self.window_size]
+            window = window[np.argsort(self.lengths[window], kind='stable')]
+            batches = self._split(window)
+            for j in self.rng.permutation(len(batches)):
+                yield batches[j]
+
+    def _make_padded(self, ids: np.ndarray) -> Any:
+        padded, mask = pad_sequences([self.x[i] for i in ids], self.pad_value)
+        batch = [padded, mask]
+        if self.y is not None:
+            if isinstance(self.y, (np.ndarray, torch.Tensor)):
+                batch.append(self.y[ids])
             else:
-                yield self.x[selected]
+                batch.append(np.asarray([self.y[i] for i in ids]))
+        if self.return_tensors:
+            batch = [torch.as_tensor(a) for a in batch]
+        batch = tuple(batch)
+        return batch if self.collate_fn is None else self.collate_fn(batch)
+
+    def _batches(self, tot_nbatch) -> Iterator[Any]:
+        while tot_nbatch > 0:
+            self.epoch += 1
+            for ids in self._epoch_ids():
+                if tot_nbatch == 0:
+                    return
+                tot_nbatch -= 1
+                yield self._make_padded(ids)
+
+
+def pad_sequences(seqs: Sequence[Any], pad_value: Any = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Stacks sequences of different lengths into one padded array.
+
+    Parameters
+    ----------
+    seqs : Sequence[Any]
+        the sequences, each one turned into an array of shape (length, ...) with np.asarray.
+    pad_value : Any
+        the value of the padding positions.
+
+    Returns
+    -------
+    padded : np.ndarray
+        an array of shape (len(seqs), longest length, ...).
+    mask : np.ndarray
+        a boolean array of shape (len(seqs), longest length), True on the real positions.
+    """
+    arrays = [np.asarray(seq) for seq in seqs]
+    lengths = np.array([len(a) for a in arrays])
+    max_len = lengths.max() if len(arrays) else 0
+    # empty sequences are float arrays, they should not decide the dtype
+    non_empty = [a for a in arrays if len(a)] or arrays or [np.zeros(0)]
+    padded = np.full((len(arrays), max_len) + non_empty[0].shape[1:], pad_value,
+                     dtype=np.result_type(*non_empty))
+    for row, a in zip(padded, arrays):
+        row[:len(a)] = a
+    mask = np.arange(max_len) < lengths[:, None]
+    return padded, mask
+
+
+def _open_source(src):
+    if isinstance(src, (str, Path)):
+        if Path(src).suffix != '.npy':
+            raise ValueError(f'Only .npy files can be opened by path, got {src}. Pass HDF5 '
+                             f'datasets as read_hdf5(fpath, lazy=True)[key] instead')
+        return np.load(src, mmap_mode='r')
+    return src
+
+
+def _default_block_size(x, target_bytes: int = 2 ** 20) -> int:
+    dtype, shape = getattr(x, 'dtype', None), getattr(x, 'shape', None)
+    if dtype is None or shape is None:
+        return 1024
+    row_bytes = max(dtype.itemsize * int(np.prod(shape[1:])), 1)
+    chunks = getattr(x, 'chunks', None)
+    # whole chunks, so no chunk of a compressed dataset is decompressed twice
+    step = chunks[0] if chunks else 1
+    return step * max(1, target_bytes // (row_bytes * step))
+
+
+def _make_batch(x, y, collate_fn, selected):
+    batch = x[selected] if y is None else (x[selected], y[selected])
+    return batch if collate_fn is None else collate_fn(batch)
+
+
+def _pin(batch: Any) -> Any:
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(_pin(item) for item in batch)
+    if isinstance(batch, dict):
+        return {key: _pin(value) for key, value in batch.items()}
+    if isinstance(batch, np.ndarray):
+        batch = torch.from_numpy(batch)
+    if isinstance(batch, torch.Tensor) and torch.cuda.is_available():
+        batch = batch.pin_memory()
+    return batch
+
+
+_worker_state = None
+
+
+def _init_worker(x, y, collate_fn):
+    global _worker_state
+    _worker_state = (x, y, collate_fn)
+
+
+def _worker_batch(selected):
+    return _make_batch(*_worker_state, selected)
@@ -0,0 +1,271 @@
+"""A thread-safe, sharded Database and a batched submission path for worker processes."""
+from typing import TypeVar, Generic, Iterable, Sequence, Mapping, Union, List, Any, Optional
+
+import sys
+import heapq
+import threading
+import multiprocessing as mp
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from itertools import islice
+from operator import itemgetter
+
+from utils.data.database import Database, _MASK64, _to_us, _from_us
+from utils.data.index import ParetoFront
+
+T = TypeVar('T')
+
+
+class ConcurrentDatabase(Generic[T]):
+    """A Database that can be shared by threads, and fed by processes through a queue.
+
+    Objects are hash-partitioned across shards. Each shard is a Database guarded by its own lock
+    and holds the frequencies, time stamps and indices of its objects. A global insertion log,
+    appended to while the shard lock is held, gives the same sequence numbers, recency and
+    positional access as the serial Database.
+
+    Worker processes cannot share the object, instead they send batches through the queue
+    returned by start_server() (see BatchSubmitter), and a thread of the owner process extends
+    the database with them.
+
+    Parameters
+    ----------
+    n_shards : int
+        the number of shards.
+    keep_sorted_list_of : Iterable[str]
+        see Database.
+    pareto_of : Union[Sequence[str], Mapping[str, str]]
+        see Database.
+    """
+
+    def __init__(self, n_shards: int = 16, keep_sorted_list_of: Iterable[str] = None,
+                 pareto_of: Union[Sequence[str], Mapping[str, str]] = None):
+        keys = list(keep_sorted_list_of or [])
+        self._shards = [Database(keys, pareto_of) for _ in range(n_shards)]
+        self._locks = [threading.Lock() for _ in range(n_shards)]
+        self._pareto_of = pareto_of
+        self._keys = keys
+
+        self._log_lock = threading.Lock()
+        self._log_ts = array('q')
+        self._log_objs: List[T] = []
+        self._objs: List[T] = []
+
+        self._server: Optional[threading.Thread] = None
+        self._queue = None
+        self._server_error: Optional[BaseException] = None
+
+    def _shard_id(self, dsn: T) -> int:
+        return hash(dsn) % len(self._shards)
+
+    def _now(self) -> int:
+        now = _to_us(datetime.utcnow())
+        if self._log_ts and now < self._log_ts[-1]:
+            now = self._log_ts[-1]
+        return now
+
+    def add(self, dsn: T):
+        sid = self._shard_id(dsn)
+        shard = self._shards[sid]
+        # lock order is always shard -> log, so adds of the same object are logged in the order
+        # they are applied to the shard.
+        with self._locks[sid]:
+            is_new = dsn not in shard
+            with self._log_lock:
+                ts = self._now()
+                self._log_ts.append(ts)
+                self._log_objs.append(dsn)
+                if is_new:
+                    self._objs.append(dsn)
+            shard._insert(dsn, ts)
+
+    def extend(self, designs: Sequence[T]):
+        for dsn in designs:
+            self.add(dsn)
+
+    def __len__(self):
+        return len(self._log_ts)
+
+    def __contains__(self, item: T):
+        return item in self._shards[self._shard_id(item)]
+
+    def __iter__(self):
+        return iter(list(self._objs))
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}[{len(self)} elements ({self.n_unique} unique), ' \
+               f'{len(self._shards)} shards]'
+
+    def __getitem__(self, item: Any):
+        """indexing base in index / time stamp / object [returns time-stamp]"""
+        if isinstance(item, (int, slice)):
+            return self._log_objs[item]
+
+        if isinstance(item, datetime):
+            us = _to_us(item)
+            with self._log_lock:
+                idx = bisect_right(self._log_ts, us) - 1
+                if idx < 0 or self._log_ts[idx] != us:
+                    raise KeyError(item)
+                return self._log_objs[idx]
+
+        sid = self._shard_id(item)
+        with self._locks[sid]:
+            return self._shards[sid][item]
+
+    def __hash__(self):
+        # same multiset hash as Database, the shard sums simply add up.
+        return (sum(shard._hash_sum for shard in self._shards) & _MASK64) & sys.maxsize
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, (Database, ConcurrentDatabase)):
+            return NotImplemented
+        if len(self) != len(other) or self.n_unique != other.n_unique or hash(self) != hash(other):
+            return False
+        return all(other.freq(obj) == self.freq(obj) for obj in self)
+
+    def freq(self, item: T) -> int:
+        sid = self._shard_id(item)
+        with self._locks[sid]:
+            return self._shards[sid].freq(item)
+
+    def since(self, t: datetime) -> List[T]:
+        with self._log_lock:
+            return self._log_objs[bisect_left(self._log_ts, _to_us(t)):]
+
+    def between(self, t0: datetime, t1: datetime) -> List[T]:
+        with self._log_lock:
+            start = bisect_left(self._log_ts, _to_us(t0))
+            stop = bisect_left(self._log_ts, _to_us(t1))
+            return self._log_objs[start:stop]
+
+    def time_stamp(self, seq: int) -> datetime:
+        return _from_us(self._log_ts[seq])
+
+    def top_k(self, key: str, k: int, largest: bool = False) -> List[T]:
+        parts = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                parts.append(shard.top_k(key, k, largest))
+        return list(islice(heapq.merge(*parts, key=itemgetter(key), reverse=largest), k))
+
+    def range(self, key: str, lo: Any = None, hi: Any = None) -> List[T]:
+        parts = []
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                parts.append(shard.range(key, lo, hi))
+        return list(heapq.merge(*parts, key=itemgetter(key)))
+
+    def pareto_front(self, sort_by: str = None) -> List[T]:
+        if self._pareto_of is None:
+            raise ValueError('Database was not created with pareto_of objectives')
+        # the global front is the front of the union of the shard fronts.
+        front = ParetoFront(self._pareto_of)
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                front.update(shard.pareto)
+        return front.to_list(sort_by)
+
+    @property
+    def tot_freq(self):
+        return len(self._log_ts)
+
+    @property
+    def n_unique(self):
+        return len(self._objs)
+
+    def to_database(self) -> Database[T]:
+        """Returns a serial Database with the same content and insertion log."""
+        db = Database(self._keys, self._pareto_of)
+        with self._log_lock:
+            for ts, dsn in zip(self._log_ts, self._log_objs):
+                db._insert(dsn, ts)
+        return db
+
+    def start_server(self, ctx: Any = None) -> 'mp.Queue':
+        """Starts a thread that extends this database with the batches put on the returned queue.
+
+        Parameters
+        ----------
+        ctx : Any
+            the multiprocessing context used to create the queue, defaults to multiprocessing.
+
+        Returns
+        -------
+        queue : multiprocessing.Queue
+            pass it to the worker processes and wrap it in a BatchSubmitter there.
+        """
+        if self._server is not None:
+            raise ValueError('The server is already running')
+        self._queue = (ctx or mp).Queue()
+        self._server = threading.Thread(target=self._serve, args=(self._queue,), daemon=True)
+        self._server.start()
+        return self._queue
+
+    def stop_server(self):
+        """Applies every batch already put on the queue, then stops the server thread.
+
+        Raises the first error raised while applying a batch, if any. The batches after it are
+        still applied.
+        """
+        if self._server is None:
+            return
+        self._queue.put(None)
+        self._server.join()
+        self._server = None
+        self._queue = None
+        error, self._server_error = self._server_error, None
+        if error is not None:
+            raise error
+
+    def _serve(self, queue: 'mp.Queue'):
+        while True:
+            batch = queue.get()
+            if batch is None:
+                return
+            try:
+                self.extend(batch)
+            except Exception as e:
+                # keep serving, so the workers' batches are not silently dropped
+                if self._server_error is None:
+                    self._server_error = e
+
+
+class BatchSubmitter(Generic[T]):
+    """Collects adds in a worker process and sends them to ConcurrentDatabase in batches.
+
+    Parameters
+    ----------
+    queue : multiprocessing.Queue
+        the queue returned by ConcurrentDatabase.start_server().
+    batch_size : int
+        the number of adds sent per message.
+    """
+
+    def __init__(self, queue: 'mp.Queue', batch_size: int = 256):
+        self._queue = queue
+        self._batch_size = batch_size
+        self._buffer: List[T] = []
+
+    def __enter__(self) -> 'BatchSubmitter[T]':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.flush()
+
+    def add(self, dsn: T):
+        self._buffer.append(dsn)
+        if len(self._buffer) >= self._batch_size:
+            self.flush()
+
+    def extend(self, designs: Iterable[T]):
+        for dsn in designs:
+            self.add(dsn)
+
+    def flush(self):
+        if self._buffer:
+            self._queue.put(self._buffer)
+            self._buffer = []
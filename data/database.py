@@ -1,14 +1,41 @@
-from typing import Sequence, Any, Dict, TypeVar, Iterable, Generic
+from typing import Sequence, Any, Dict, TypeVar, Iterable, Generic, List, Mapping, Union
 
+import sys
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import OrderedDict
-from sortedcollections import SortedList
-from datetime import datetime
+from datetime import datetime, timedelta
 from copy import copy
+from operator import itemgetter
 
-from utils.immutable import to_immutable
+from utils.data.index import SortedIndex, ParetoFront
 
 T = TypeVar('T')
 
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_us(dt: datetime) -> int:
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def _from_us(us: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=us)
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix_hash(h: int) -> int:
+    """Scrambles a hash value (splitmix64 finalizer), so sums of hashes do not cancel out."""
+    z = (h + 0x9e3779b97f4a7c15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & _MASK64
+    return z ^ (z >> 31)
+
+
 class Database(Generic[T]):
     """
     This is a database of hashable objects. It will keep track of the frequency and uniqueness of
@@ -17,113 +44,317 @@ class Database(Generic[T]):
     asking for a certain top property O(1)
     asking for a sorted list return O(1)
     insertion new elements O(1) / O(nlogn)
-    """
+    positional access O(1), time range queries O(log n)
 
-    def __init__(self, keep_sorted_list_of: Iterable[str] = None):
+    Objects can be indexed by the value of some of their keys (keep_sorted_list_of), which gives
+    top_k and range queries in O(log n + k), and by several objectives at once (pareto_of), which
+    keeps the non-dominated set up to date as objects are added.
 
-        self._freq_dict: OrderedDict[T, int] = OrderedDict()
-        self._list: Dict[datetime, T] = {}
-        self._rlist: Dict[T, datetime] = {}
-        self._tot_freq = 0
+    Every add is appended to an insertion log made of two int64 arrays: the UTC time stamp in
+    microseconds and the id of the added object. The position in the log is a monotonic sequence
+    number, so adds within the same microsecond never collide. Time stamps are clamped to be
+    non-decreasing, so the log can be bisected by time.
 
-        self.sorted_lists = {}
+    The hash is a multiset hash, i.e. the sum of the (scrambled) hashes of every added object,
+    so it is maintained in O(1) per add and does not depend on the insertion order.
+    """
+
+    def __init__(self, keep_sorted_list_of: Iterable[str] = None,
+                 pareto_of: Union[Sequence[str], Mapping[str, str]] = None):
+
+        # unique objects, in first insertion order
+        self._ids: Dict[T, int] = {}
+        self._objs: List[T] = []
+        self._freq = array('q')
+        self._last_seq = array('q')
+        self._mixed_hash = array('Q')
+        self._hash_sum = 0
+        # the insertion log, indexed by sequence number
+        self._log_ts = array('q')
+        self._log_ids = array('q')
+
+        self.sorted_lists: Dict[str, SortedIndex[T]] = {}
         if keep_sorted_list_of:
             for key in keep_sorted_list_of:
-                self.sorted_lists[key] = SortedList(key=lambda x: x[key])
+                self.sorted_lists[key] = SortedIndex(key)
+        self.pareto = ParetoFront(pareto_of) if pareto_of else None
+
+    def _now(self) -> int:
+        now = _to_us(datetime.utcnow())
+        if self._log_ts and now < self._log_ts[-1]:
+            # the wall clock went backwards
+            now = self._log_ts[-1]
+        return now
 
     def add(self, dsn: T):
-        dt =  datetime.utcnow()
         # if not isinstance(dsn, self._T):
         #     raise ValueError(f'Database of type {self._T.__name__} cannot accept '
         #                      f'type {dsn.__class__.__name__}')
-
-        if dsn in self._freq_dict:
-            self._freq_dict[dsn] += 1
-            self._rlist[dsn] = dt
-            self._list[dt] = dsn
-        else:
-            self._rlist[dsn] = dt
-            self._list[dt] = dsn
-            self._freq_dict[dsn] = 1
+        self._insert(dsn, self._now())
+
+    def _insert(self, dsn: T, ts: int):
+        seq = len(self._log_ts)
+        uid = self._ids.get(dsn)
+        if uid is None:
+            uid = len(self._objs)
+            self._ids[dsn] = uid
+            self._objs.append(dsn)
+            self._freq.append(1)
+            self._last_seq.append(seq)
+            self._mixed_hash.append(_mix_hash(hash(dsn)))
             if self.sorted_lists:
                 for key in self.sorted_lists:
                     self.sorted_lists[key].add(dsn)
+            if self.pareto is not None:
+                self.pareto.add(dsn)
+        else:
+            self._freq[uid] += 1
+            self._last_seq[uid] = seq
 
-        self._tot_freq += 1
+        self._hash_sum = (self._hash_sum + self._mixed_hash[uid]) & _MASK64
+        self._log_ts.append(ts)
+        self._log_ids.append(uid)
 
     def __copy__(self):
         # this method does not recreate the design instances.
         copied = self.__class__()
-        copied._freq_dict = copy(self._freq_dict)
-        copied._list = copy(self._list)
-        copied._rlist = copy(self._rlist)
-        copied._tot_freq = copy(self._tot_freq)
+        copied._ids = copy(self._ids)
+        copied._objs = copy(self._objs)
+        copied._freq = copy(self._freq)
+        copied._last_seq = copy(self._last_seq)
+        copied._mixed_hash = copy(self._mixed_hash)
+        copied._hash_sum = self._hash_sum
+        copied._log_ts = copy(self._log_ts)
+        copied._log_ids = copy(self._log_ids)
         copied.sorted_lists = dict([(k, copy(v)) for k, v in self.sorted_lists.items()])
+        copied.pareto = copy(self.pareto)
         return copied
 
     def extend(self, designs: Sequence[T]):
+        """Adds the given objects in one batch, which all get the same time stamp.
+
+        New objects are deduplicated first and inserted into each index with a single bulk update.
+        """
+        designs = list(designs)
+        if designs:
+            self._extend(designs, self._now())
+
+    def _extend(self, designs: List[T], ts: int):
+        ids, objs = self._ids, self._objs
+        freq, last_seq, mixed_hash = self._freq, self._last_seq, self._mixed_hash
+        # look every object up before changing anything, so an unhashable one leaves the
+        # database as it was.
+        new_ids: Dict[T, int] = {}
+        uids = array('q')
         for dsn in designs:
-            self.add(dsn)
+            uid = ids.get(dsn)
+            if uid is None:
+                uid = new_ids.setdefault(dsn, len(objs) + len(new_ids))
+            uids.append(uid)
+
+        new = list(new_ids)
+        for dsn in new:
+            ids[dsn] = len(objs)
+            objs.append(dsn)
+            freq.append(0)
+            last_seq.append(0)
+            mixed_hash.append(_mix_hash(hash(dsn)))
+
+        hash_sum = self._hash_sum
+        for seq, uid in enumerate(uids, len(self._log_ts)):
+            freq[uid] += 1
+            last_seq[uid] = seq
+            hash_sum += mixed_hash[uid]
+        self._hash_sum = hash_sum & _MASK64
+        self._log_ts.extend(array('q', [ts]) * len(uids))
+        self._log_ids.extend(uids)
+
+        if new:
+            for index in self.sorted_lists.values():
+                index.update(new)
+            if self.pareto is not None:
+                self.pareto.update(new)
+
+    def merge(self, *others: 'Database[T]'):
+        """Adds the content of other databases into this one.
+
+        Frequencies are summed, the insertion logs are merged by time stamp (so the time stamp of
+        an object is the latest one among all databases), and only the objects new to this
+        database are inserted into its indices.
+        """
+        logs = [zip(self._log_ts, self._log_ids)]
+        n_old = len(self._objs)
+        new = []
+        candidates = []
+        for other in others:
+            remap = array('q')
+            for obj in other._objs:
+                uid = self._ids.get(obj)
+                if uid is None:
+                    uid = len(self._objs)
+                    self._ids[obj] = uid
+                    self._objs.append(obj)
+                    self._freq.append(0)
+                    self._last_seq.append(0)
+                    self._mixed_hash.append(_mix_hash(hash(obj)))
+                    new.append(obj)
+                remap.append(uid)
+            for uid, f in zip(remap, other._freq):
+                self._freq[uid] += f
+            # multiset hashes add up.
+            self._hash_sum = (self._hash_sum + other._hash_sum) & _MASK64
+            logs.append(zip(other._log_ts, [remap[uid] for uid in other._log_ids]))
+            if self.pareto is not None:
+                if other.pareto is not None and other.pareto.objectives == self.pareto.objectives:
+                    # the front of the union is within the union of the fronts.
+                    candidates.extend(other.pareto)
+                else:
+                    candidates.extend(other._objs)
+
+        log_ts, log_ids = array('q'), array('q')
+        for ts, uid in heapq.merge(*logs, key=itemgetter(0)):
+            log_ts.append(ts)
+            log_ids.append(uid)
+        self._log_ts, self._log_ids = log_ts, log_ids
+        for seq, uid in enumerate(log_ids):
+            self._last_seq[uid] = seq
+
+        for index in self.sorted_lists.values():
+            index.update(new)
+        if self.pareto is not None:
+            # objects this database already held are in its front or dominated by it, and the
+            # front keeps equal points, so only the new ones are added, once each.
+            fresh = {obj: None for obj in candidates if self._ids[obj] >= n_old}
+            self.pareto.update(list(fresh))
 
     def __len__(self):
-        return len(self._list)
+        return len(self._log_ts)
 
     def __contains__(self, item: T):
-        return item in self._freq_dict
+        return item in self._ids
 
     def __repr__(self) -> str:
-        nb = len(self._list)
-        nu = len(self._freq_dict)
+        nb = len(self._log_ts)
+        nu = len(self._objs)
 
         rep = f'Database[{nb} elements ({nu} unique)]\n'
 
         if nu == 0:
             return rep
 
-        for i, dsn in enumerate(self._freq_dict):
+        for i, dsn in enumerate(self._objs):
             rep += f'    {repr(dsn)},\n'
             if i > 2:
                 break
 
         if nu > 4:
             rep += '    ...\n'
-            last_dsn = next(reversed(self._freq_dict.keys()))
+            last_dsn = self._objs[-1]
             rep += f'    {repr(last_dsn)}'
 
         return rep
 
+    def _rehash(self):
+        # object hashes (e.g. of strings) are not stable across processes.
+        self._mixed_hash = array('Q', (_mix_hash(hash(obj)) for obj in self._objs))
+        self._hash_sum = sum(h * f for h, f in zip(self._mixed_hash, self._freq)) & _MASK64
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        # the pickled hashes are the ones of the process that pickled the database
+        self._rehash()
+
     def __hash__(self):
-        return hash(to_immutable(self._freq_dict))
+        return self._hash_sum & sys.maxsize
 
     def __eq__(self, other):
-        if hash(self) != hash(other):
+        if self is other:
+            return True
+        if not isinstance(other, Database):
+            return NotImplemented
+        if (len(self) != len(other) or self.n_unique != other.n_unique or
+                self._hash_sum != other._hash_sum):
             return False
         # hash collision
-        for obj in self:
-            if obj not in other:
+        for obj, freq in zip(self._objs, self._freq):
+            if other.freq(obj) != freq:
                 return False
         return True
 
     def __iter__(self):
-        return iter(self._rlist.keys())
+        return iter(self._objs)
 
     def __getitem__(self, item: Any):
         """indexing base in index / time stamp / object [returns time-stamp]"""
         if isinstance(item, int):
-            return list(self._list.values())[item]
+            return self._objs[self._log_ids[item]]
 
-        if isinstance(item, datetime):
-            return self._list[item]
+        if isinstance(item, slice):
+            return [self._objs[uid] for uid in self._log_ids[item]]
 
-        return self._rlist[item]
+        if isinstance(item, datetime):
+            # the last object added at exactly this time stamp
+            us = _to_us(item)
+            idx = bisect_right(self._log_ts, us) - 1
+            if idx < 0 or self._log_ts[idx] != us:
+                raise KeyError(item)
+            return self._objs[self._log_ids[idx]]
+
+        return _from_us(self._log_ts[self._last_seq[self._ids[item]]])
+
+    def freq(self, item: T) -> int:
+        """Returns the number of times the given object was added."""
+        uid = self._ids.get(item)
+        return 0 if uid is None else self._freq[uid]
+
+    def freq_dict(self) -> 'OrderedDict[T, int]':
+        """Returns the frequency of every unique object, in first insertion order."""
+        return OrderedDict(zip(self._objs, self._freq))
+
+    def time_stamp(self, seq: int) -> datetime:
+        """Returns the time stamp of the given position in the insertion log."""
+        return _from_us(self._log_ts[seq])
+
+    def since(self, t: datetime) -> List[T]:
+        """Returns the objects added at or after t, in insertion order (with repetitions)."""
+        return self[bisect_left(self._log_ts, _to_us(t)):]
+
+    def between(self, t0: datetime, t1: datetime) -> List[T]:
+        """Returns the objects added in [t0, t1), in insertion order (with repetitions)."""
+        start = bisect_left(self._log_ts, _to_us(t0))
+        stop = bisect_left(self._log_ts, _to_us(t1))
+        return self[start:stop]
+
+    def _get_index(self, key: str) -> SortedIndex[T]:
+        try:
+            return self.sorted_lists[key]
+        except KeyError:
+            raise KeyError(f'Database does not keep a sorted list of {key}') from None
+
+    def top_k(self, key: str, k: int, largest: bool = False) -> List[T]:
+        """Returns the k unique objects with the smallest (or largest) obj[key], best first."""
+        return self._get_index(key).top_k(k, largest)
+
+    def range(self, key: str, lo: Any = None, hi: Any = None) -> List[T]:
+        """Returns the unique objects with lo <= obj[key] <= hi, sorted by obj[key].
+
+        Either bound may be None to leave that side open.
+        """
+        return self._get_index(key).range(lo, hi)
+
+    def pareto_front(self, sort_by: str = None) -> List[T]:
+        """Returns the non-dominated unique objects over the pareto_of objectives."""
+        if self.pareto is None:
+            raise ValueError('Database was not created with pareto_of objectives')
+        return self.pareto.to_list(sort_by)
 
     @property
     def tot_freq(self):
-        return self._tot_freq
+        return len(self._log_ts)
 
     @property
     def n_unique(self):
-        return len(self._freq_dict)
+        return len(self._objs)
 
     def picklable(self):
         return PicklableDataBase.create_from_database(self)
@@ -131,43 +362,91 @@ class Database(Generic[T]):
 
 class PicklableDataBase(Generic[T]):
 
-    def __init__(self, keep_sorted_list_of: Iterable[str] = None):
-        self._freq_dict: Dict[T, int] = {}
-        self._list: Dict[datetime, T] = {}
-        self._rlist: Dict[T, datetime] = {}
-        self._tot_freq = 0
+    def __init__(self, keep_sorted_list_of: Iterable[str] = None,
+                 pareto_of: Union[Sequence[str], Mapping[str, str]] = None):
+        self._objs: List[T] = []
+        self._freq = array('q')
+        self._last_seq = array('q')
+        self._log_ts = array('q')
+        self._log_ids = array('q')
 
         self.sorted_lists = {}
         if keep_sorted_list_of:
             for key in keep_sorted_list_of:
                 self.sorted_lists[key] = []
+        self.pareto_of = pareto_of
+        self.pareto_front: List[T] = []
 
     @classmethod
     def create_from_database(cls, db: Database):
-        inst = cls(db.sorted_lists.keys())
-        inst._freq_dict = dict(db._freq_dict)
-        inst._list = dict(db._list)
-        inst._rlist = dict(db._rlist)
-        inst._tot_freq = db._tot_freq
+        pareto_of = db.pareto.objectives if db.pareto is not None else None
+        inst = cls(db.sorted_lists.keys(), pareto_of)
+        inst._objs = list(db._objs)
+        inst._freq = copy(db._freq)
+        inst._last_seq = copy(db._last_seq)
+        inst._log_ts = copy(db._log_ts)
+        inst._log_ids = copy(db._log_ids)
         for key in db.sorted_lists:
             inst.sorted_lists[key] = list(db.sorted_lists[key])
+        if db.pareto is not None:
+            inst.pareto_front = list(db.pareto)
 
         return inst
 
-    def convert_to_database(self):
-        db = Database(self.sorted_lists.keys())
-        db._freq_dict  = OrderedDict(self._freq_dict)
-        db._list  = self._list
-        db._rlist  = self._rlist
-        db._tot_freq = self._tot_freq
-
-        for k, v in self.sorted_lists.items():
-            db.sorted_lists[k].update(v)
+    def __setstate__(self, state: Dict[str, Any]):
+        if '_freq_dict' in state:
+            state = self._convert_legacy_state(state)
+        self.__dict__.update(state)
+
+    @staticmethod
+    def _convert_legacy_state(state: Dict[str, Any]) -> Dict[str, Any]:
+        """Converts the dictionaries of older versions (_freq_dict, _list, _rlist) to the arrays.
+
+        _list only kept the last object of each time stamp, so adds that are missing from it are
+        put at the last time stamp of their object (from _rlist). The frequencies, the total
+        frequency and the last time stamp of every object are kept.
+        """
+        freq_dict, time_list, rlist = state['_freq_dict'], state['_list'], state['_rlist']
+        objs = list(freq_dict)
+        ids = {obj: uid for uid, obj in enumerate(objs)}
+
+        log = [(_to_us(dt), ids[obj]) for dt, obj in sorted(time_list.items(), key=itemgetter(0))]
+        missing = array('q', freq_dict.values())
+        for _, uid in log:
+            missing[uid] -= 1
+        for uid, n in enumerate(missing):
+            if n > 0:
+                log.extend([(_to_us(rlist[objs[uid]]), uid)] * n)
+        # stable, so the missing adds stay after the ones of the same time stamp in _list
+        log.sort(key=itemgetter(0))
+
+        last_seq = array('q', [0]) * len(objs)
+        for seq, (_, uid) in enumerate(log):
+            last_seq[uid] = seq
+        return dict(_objs=objs, _freq=array('q', freq_dict.values()), _last_seq=last_seq,
+                    _log_ts=array('q', map(itemgetter(0), log)),
+                    _log_ids=array('q', map(itemgetter(1), log)),
+                    sorted_lists=state.get('sorted_lists', {}), pareto_of=None, pareto_front=[])
 
+    def convert_to_database(self):
+        db = Database(self.sorted_lists.keys(), self.pareto_of)
+        self.restore_into(db)
         return db
 
-
-
-
-
-
+    def restore_into(self, db: Database):
+        """Loads this state into the given empty database.
+
+        Indices of db that are missing from this state are rebuilt from the objects.
+        """
+        db._objs = self._objs
+        db._ids = {obj: uid for uid, obj in enumerate(self._objs)}
+        db._freq = self._freq
+        db._last_seq = self._last_seq
+        db._log_ts = self._log_ts
+        db._log_ids = self._log_ids
+        db._rehash()
+
+        for k, v in db.sorted_lists.items():
+            v.update(self.sorted_lists.get(k, self._objs))
+        if db.pareto is not None:
+            db.pareto.update(self.pareto_front if self.pareto_of else self._objs)
@@ -0,0 +1,174 @@
+"""A Database persisted as an append-only log with periodic snapshots."""
+from typing import TypeVar, Iterable, Union, Sequence, Mapping, Optional, BinaryIO, Any
+
+import os
+import re
+import pickle
+from pathlib import Path
+
+from utils.file import read_pickle, write_pickle, pack_record, read_records
+from utils.data.database import Database, PicklableDataBase
+
+T = TypeVar('T')
+
+_SNAPSHOT_RE = re.compile(r'snapshot-(\d+)\.pickle')
+_LOG_RE = re.compile(r'log-(\d+)\.bin')
+
+
+class DurableDatabase(Database[T]):
+    """A Database whose adds are appended to an on-disk log.
+
+    The state lives in a directory as generations: snapshot-<gen>.pickle holds the full database
+    and log-<gen>.bin the adds made after it, as length-prefixed, CRC-checked pickle records of
+    (time stamp, object). Opening the directory replays the latest snapshot plus its log tail; a
+    torn record at the end of the log (e.g. after a crash) is dropped. checkpoint() only flushes
+    the records added since the last checkpoint, and snapshot() compacts the log into a new
+    generation.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        the database directory, created if it does not exist.
+    keep_sorted_list_of : Iterable[str]
+        see Database.
+    pareto_of : Union[Sequence[str], Mapping[str, str]]
+        see Database.
+    snapshot_every : int
+        if positive, checkpoint() takes a snapshot once the log has this many records.
+    fsync : bool
+        True to fsync the log on every checkpoint.
+    """
+
+    def __init__(self, root: Union[str, Path], keep_sorted_list_of: Iterable[str] = None,
+                 pareto_of: Union[Sequence[str], Mapping[str, str]] = None,
+                 snapshot_every: int = 0, fsync: bool = True):
+        Database.__init__(self, keep_sorted_list_of, pareto_of)
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._snapshot_every = snapshot_every
+        self._fsync = fsync
+        self._log: Optional[BinaryIO] = None
+        self._gen = 0
+        self._n_log_records = 0
+        self._replaying = False
+        self._recover()
+
+    def __enter__(self) -> 'DurableDatabase[T]':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    @property
+    def n_log_records(self) -> int:
+        """the number of adds in the log since the last snapshot."""
+        return self._n_log_records
+
+    def _snapshot_path(self, gen: int) -> Path:
+        return self._root / f'snapshot-{gen:06d}.pickle'
+
+    def _log_path(self, gen: int) -> Path:
+        return self._root / f'log-{gen:06d}.bin'
+
+    def _generations(self, pattern: 're.Pattern') -> Sequence[int]:
+        ans = []
+        for fpath in self._root.iterdir():
+            match = pattern.fullmatch(fpath.name)
+            if match:
+                ans.append(int(match.group(1)))
+        return sorted(ans)
+
+    def _recover(self):
+        snapshots = self._generations(_SNAPSHOT_RE)
+        if snapshots:
+            self._gen = snapshots[-1]
+            state: PicklableDataBase = read_pickle(self._snapshot_path(self._gen))
+            state.restore_into(self)
+
+        log_path = self._log_path(self._gen)
+        valid_bytes = 0
+        if log_path.exists():
+            self._replaying = True
+            try:
+                with open(log_path, 'rb') as f:
+                    for valid_bytes, payload in read_records(f):
+                        ts, dsn = pickle.loads(payload)
+                        Database._insert(self, dsn, ts)
+                        self._n_log_records += 1
+            finally:
+                self._replaying = False
+
+        self._log = open(log_path, 'ab')
+        if self._log.tell() != valid_bytes:
+            # drop a torn record left by a crash.
+            self._log.truncate(valid_bytes)
+            self._log.seek(valid_bytes)
+        self._remove_old_generations()
+
+    def _insert(self, dsn: T, ts: int):
+        Database._insert(self, dsn, ts)
+        if not self._replaying:
+            payload = pickle.dumps((ts, dsn), protocol=pickle.HIGHEST_PROTOCOL)
+            self._log.write(pack_record(payload))
+            self._n_log_records += 1
+
+    def _extend(self, designs: Sequence[T], ts: int):
+        Database._extend(self, designs, ts)
+        # one record per add, so the log format does not depend on how objects were added.
+        self._log.write(b''.join(
+            pack_record(pickle.dumps((ts, dsn), protocol=pickle.HIGHEST_PROTOCOL))
+            for dsn in designs))
+        self._n_log_records += len(designs)
+
+    def merge(self, *others: Database[T]):
+        """See Database.merge. Merging rewrites the insertion log, so it ends with a snapshot."""
+        Database.merge(self, *others)
+        self.snapshot()
+
+    def checkpoint(self):
+        """Makes every add so far durable. Costs O(adds since the last checkpoint).
+
+        Takes a snapshot instead if the log grew past snapshot_every records.
+        """
+        if self._snapshot_every and self._n_log_records >= self._snapshot_every:
+            self.snapshot()
+            return
+        self._log.flush()
+        if self._fsync:
+            os.fsync(self._log.fileno())
+
+    def snapshot(self):
+        """Writes the whole database as a new generation and starts an empty log."""
+        self._log.flush()
+        new_gen = self._gen + 1
+        snapshot_path = self._snapshot_path(new_gen)
+        tmp_path = snapshot_path.with_suffix('.tmp')
+        write_pickle(tmp_path, self.picklable())
+        if self._fsync:
+            with open(tmp_path, 'rb') as f:
+                os.fsync(f.fileno())
+        # the rename is atomic, a crash before it recovers from the previous generation.
+        os.replace(tmp_path, snapshot_path)
+
+        self._log.close()
+        self._gen = new_gen
+        self._log = open(self._log_path(new_gen), 'ab')
+        self._n_log_records = 0
+        self._remove_old_generations()
+
+    def close(self):
+        if self._log is not None and not self._log.closed:
+            self.checkpoint()
+            self._log.close()
+
+    def _remove_old_generations(self):
+        for gen in self._generations(_SNAPSHOT_RE):
+            if gen < self._gen:
+                self._snapshot_path(gen).unlink()
+        for gen in self._generations(_LOG_RE):
+            if gen < self._gen:
+                self._log_path(gen).unlink()
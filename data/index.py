@@ -0,0 +1,137 @@
+"""Secondary indices over the objects of a Database."""
+from typing import (
+    TypeVar, Generic, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+)
+
+from itertools import islice
+from operator import itemgetter
+from sortedcollections import SortedList
+
+T = TypeVar('T')
+
+
+class SortedIndex(Generic[T]):
+    """Objects sorted by the value of one of their keys (obj[key]).
+
+    Parameters
+    ----------
+    key : str
+        the key to sort by.
+    """
+
+    def __init__(self, key: str, objs: Iterable[T] = ()) -> None:
+        self.key = key
+        self._list = SortedList(objs, key=itemgetter(key))
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(key={self.key!r}, size={len(self)})'
+
+    def __len__(self) -> int:
+        return len(self._list)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._list)
+
+    def __getitem__(self, idx):
+        return self._list[idx]
+
+    def __copy__(self) -> 'SortedIndex[T]':
+        ans = self.__class__(self.key)
+        ans._list = self._list.copy()
+        return ans
+
+    def add(self, obj: T) -> None:
+        self._list.add(obj)
+
+    def update(self, objs: Iterable[T]) -> None:
+        self._list.update(objs)
+
+    def top_k(self, k: int, largest: bool = False) -> List[T]:
+        """Returns the k objects with the smallest (or largest) key, best first. O(log n + k)."""
+        if largest:
+            return list(islice(reversed(self._list), k))
+        return list(islice(self._list, k))
+
+    def range(self, lo=None, hi=None, inclusive: Tuple[bool, bool] = (True, True)) -> List[T]:
+        """Returns the objects with lo <= obj[key] <= hi in sorted order. O(log n + k).
+
+        Either bound may be None to leave that side open.
+        """
+        return list(self._list.irange_key(lo, hi, inclusive))
+
+
+class ParetoFront(Generic[T]):
+    """An incrementally maintained set of non-dominated objects.
+
+    Adding an object costs O(size of the front): it is rejected if a member dominates it,
+    otherwise it is added and the members it dominates are removed.
+
+    Parameters
+    ----------
+    objectives : Union[Sequence[str], Mapping[str, str]]
+        the keys of the objectives. Either a sequence of keys to minimize or a mapping from key to
+        'min' or 'max'.
+    """
+
+    def __init__(self, objectives: Union[Sequence[str], Mapping[str, str]],
+                 objs: Iterable[T] = ()) -> None:
+        if isinstance(objectives, Mapping):
+            self.objectives = dict(objectives)
+        else:
+            self.objectives = {key: 'min' for key in objectives}
+        for key, sense in self.objectives.items():
+            if sense not in ('min', 'max'):
+                raise ValueError(f'Objective {key} must be min or max, got {sense}')
+
+        self._keys = list(self.objectives)
+        self._signs = [1 if self.objectives[k] == 'min' else -1 for k in self._keys]
+        self._front: List[Tuple[Tuple[float, ...], T]] = []
+        self.update(objs)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(objectives={self.objectives}, size={len(self)})'
+
+    def __len__(self) -> int:
+        return len(self._front)
+
+    def __iter__(self) -> Iterator[T]:
+        return (obj for _, obj in self._front)
+
+    def __copy__(self) -> 'ParetoFront[T]':
+        ans = self.__class__(self.objectives)
+        ans._front = list(self._front)
+        return ans
+
+    def _point(self, obj: T) -> Tuple[float, ...]:
+        return tuple(s * obj[k] for k, s in zip(self._keys, self._signs))
+
+    @staticmethod
+    def _dominates(a: Tuple[float, ...], b: Tuple[float, ...]) -> bool:
+        return all(x <= y for x, y in zip(a, b)) and a != b
+
+    def add(self, obj: T) -> bool:
+        """Adds the given object if it is not dominated. Returns True if it was added."""
+        p = self._point(obj)
+        dominates = self._dominates
+        for q, _ in self._front:
+            if dominates(q, p):
+                return False
+        self._front = [(q, o) for q, o in self._front if not dominates(p, q)]
+        self._front.append((p, obj))
+        return True
+
+    def update(self, objs: Iterable[T]) -> None:
+        for obj in objs:
+            self.add(obj)
+
+    def dominated_by_front(self, obj: T) -> bool:
+        """Returns True if a member of the front dominates the given object."""
+        p = self._point(obj)
+        return any(self._dominates(q, p) for q, _ in self._front)
+
+    def to_list(self, sort_by: Optional[str] = None) -> List[T]:
+        """Returns the members of the front, optionally sorted by one of the objectives."""
+        ans = list(self)
+        if sort_by is not None:
+            ans.sort(key=itemgetter(sort_by))
+        return ans
@@ -1,4 +1,5 @@
-from typing import Optional
+from typing import Optional, Iterator, Tuple, Sequence, Any, Union
+import hashlib
 import numpy as np
 
 
@@ -23,3 +24,186 @@ def split_data(data, label = None, train_per: float = 0.8):
     test_y = label[index:]
     return train_x, test_x, train_y, test_y
 
+
+class IndexView:
+    """A lazy view of data restricted to (and reordered by) an index array. Nothing is copied
+    until the view is indexed.
+
+    :param data: array_like, anything indexable by int (and by index arrays for fast batches)
+    :param indices: array_like of int
+    """
+
+    def __init__(self, data, indices):
+        self.data = data
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(len={len(self)}, data={self.data.__class__.__name__})'
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        if isinstance(item, (int, np.integer)):
+            return self.data[self.indices[item]]
+        if isinstance(item, slice):
+            return IndexView(self.data, self.indices[item])
+        selected = self.indices[item]
+        if isinstance(self.data, list):
+            return [self.data[i] for i in selected]
+        return self.data[selected]
+
+    def __iter__(self):
+        return (self.data[i] for i in self.indices)
+
+
+def take(data, indices) -> IndexView:
+    """Returns a lazy view of data[indices].
+
+    :param data: array_like
+    :param indices: array_like of int
+    :return: IndexView
+    """
+    return IndexView(data, indices)
+
+
+def _permute(n: int, shuffle: bool, rng: np.random.Generator) -> np.ndarray:
+    return rng.permutation(n) if shuffle else np.arange(n)
+
+
+def train_test_indices(n: int, train_per: float = 0.8, shuffle: bool = True,
+                       seed: Optional[int] = None, stratify=None,
+                       groups=None) -> Tuple[np.ndarray, np.ndarray]:
+    """Splits range(n) into train and test index arrays.
+
+    :param n: int, the number of samples
+    :param train_per: float, the fraction of samples in train
+    :param shuffle: bool, False to keep the head/tail order of split_data
+    :param seed: int, the seed of the shuffle
+    :param stratify: array_like of length n, labels whose proportions are kept in both splits
+    :param groups: array_like of length n, samples of the same group end up in the same split
+    :return: train_idx, test_idx
+    """
+    if stratify is not None and groups is not None:
+        raise ValueError('Cannot split with both stratify and groups')
+    rng = np.random.default_rng(seed)
+
+    if groups is not None:
+        uniques, inverse, counts = np.unique(groups, return_inverse=True, return_counts=True)
+        order = _permute(len(uniques), shuffle, rng)
+        # whole groups go to train until it holds train_per of the samples
+        n_train_groups = np.searchsorted(np.cumsum(counts[order]), train_per * n, side='right')
+        in_train = np.zeros(len(uniques), dtype=bool)
+        in_train[order[:n_train_groups]] = True
+        mask = in_train[inverse]
+        ids = _permute(n, shuffle, rng)
+        return ids[mask[ids]], ids[~mask[ids]]
+
+    if stratify is None:
+        ids = _permute(n, shuffle, rng)
+        index = int(n * train_per)
+        return ids[:index], ids[index:]
+
+    train, test = [], []
+    labels = np.asarray(stratify)
+    for label in np.unique(labels):
+        ids = np.flatnonzero(labels == label)
+        ids = ids[_permute(len(ids), shuffle, rng)]
+        index = int(round(len(ids) * train_per))
+        train.append(ids[:index])
+        test.append(ids[index:])
+    train, test = np.concatenate(train), np.concatenate(test)
+    if shuffle:
+        train, test = rng.permutation(train), rng.permutation(test)
+    else:
+        train, test = np.sort(train), np.sort(test)
+    return train, test
+
+
+def kfold_indices(n: int, k: int = 5, shuffle: bool = True, seed: Optional[int] = None,
+                  stratify=None, groups=None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Yields (train_idx, test_idx) for each of k folds of range(n).
+
+    :param n: int, the number of samples
+    :param k: int, the number of folds
+    :param shuffle: bool, False for contiguous folds
+    :param seed: int, the seed of the shuffle
+    :param stratify: array_like of length n, labels spread evenly over the folds
+    :param groups: array_like of length n, samples of the same group end up in the same fold
+    :return: an iterator over the k (train_idx, test_idx) pairs
+    """
+    if stratify is not None and groups is not None:
+        raise ValueError('Cannot split with both stratify and groups')
+    if not 2 <= k <= n:
+        raise ValueError(f'The number of folds must be in [2, {n}], got {k}')
+    rng = np.random.default_rng(seed)
+
+    if groups is not None:
+        uniques, inverse, counts = np.unique(groups, return_inverse=True, return_counts=True)
+        if len(uniques) < k:
+            raise ValueError(f'Cannot make {k} folds out of {len(uniques)} groups')
+        order = _permute(len(uniques), shuffle, rng)
+        # largest groups first, each one to the currently smallest fold
+        order = order[np.argsort(-counts[order], kind='stable')]
+        group_fold = np.empty(len(uniques), dtype=np.int64)
+        fold_sizes = np.zeros(k, dtype=np.int64)
+        for g in order:
+            fold = int(np.argmin(fold_sizes))
+            group_fold[g] = fold
+            fold_sizes[fold] += counts[g]
+        sample_fold = group_fold[inverse]
+    elif stratify is not None:
+        labels = np.asarray(stratify)
+        sample_fold = np.empty(n, dtype=np.int64)
+        offset = 0
+        for label in np.unique(labels):
+            ids = np.flatnonzero(labels == label)
+            ids = ids[_permute(len(ids), shuffle, rng)]
+            # deal the samples of each label round-robin, continuing where the last label stopped
+            sample_fold[ids] = (np.arange(len(ids)) + offset) % k
+            offset += len(ids)
+    else:
+        sample_fold = np.empty(n, dtype=np.int64)
+        sample_fold[_permute(n, shuffle, rng)] = np.arange(n) * k // n
+
+    ids = _permute(n, shuffle, rng)
+    for fold in range(k):
+        in_test = sample_fold[ids] == fold
+        yield ids[~in_test], ids[in_test]
+
+
+def _key_bytes(key: Union[str, bytes, int]) -> bytes:
+    if isinstance(key, bytes):
+        return key
+    if isinstance(key, (str, int, np.integer)):
+        return str(key).encode()
+    raise ValueError(f'Hash split keys must be str, bytes or int, got {key.__class__.__name__}')
+
+
+def hash_split(key: Union[str, bytes, int], train_per: float = 0.8, salt: str = '') -> bool:
+    """Returns True if the record with the given key belongs to train.
+
+    The assignment only depends on the key (and the salt), so it is O(1), needs no pass over the
+    data, does not depend on PYTHONHASHSEED, and a record keeps its split as the dataset grows.
+
+    :param key: str, bytes or int, a stable identifier of the record
+    :param train_per: float, the expected fraction of records in train
+    :param salt: str, changes the assignment, e.g. to draw another split of the same data
+    :return: bool
+    """
+    digest = hashlib.blake2b(_key_bytes(key), digest_size=8, key=salt.encode()).digest()
+    return int.from_bytes(digest, 'little') < train_per * 2 ** 64
+
+
+def hash_split_indices(keys: Sequence[Any], train_per: float = 0.8,
+                       salt: str = '') -> Tuple[np.ndarray, np.ndarray]:
+    """Applies hash_split to every key.
+
+    :param keys: sequence of str, bytes or int
+    :param train_per: float
+    :param salt: str
+    :return: train_idx, test_idx
+    """
+    mask = np.fromiter((hash_split(key, train_per, salt) for key in keys), dtype=bool,
+                       count=len(keys))
+    return np.flatnonzero(mask), np.flatnonzero(~mask)
@@ -0,0 +1,409 @@
+"""A Database kept in an SQLite file, for collections that do not fit in memory."""
+from typing import (
+    TypeVar, Generic, Iterable, Iterator, List, Any, Union, Sequence, Callable, Optional
+)
+
+import math
+import struct
+import pickle
+import numbers
+import sqlite3
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from utils.immutable import ImmutableSortedDict, ImmutableList, FrozenArray
+from utils.data.database import _to_us, _from_us
+
+T = TypeVar('T')
+
+
+def _encode(obj: Any, update: Callable[[bytes], None]):
+    """Feeds a canonical encoding of obj to update: objects that compare equal encode the same.
+
+    Numbers are encoded by value (1, 1.0, True and numpy scalars are equal), containers by type
+    and items, whatever their storage (an ImmutableList of an array('d') or a tuple), and shared
+    subobjects are encoded every time they appear. Other types fall back to their pickle.
+    """
+    if obj is None:
+        update(b'N')
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8', 'surrogatepass')
+        update(b'S%d:' % len(data))
+        update(data)
+    elif isinstance(obj, (bytes, bytearray)):
+        update(b'B%d:' % len(obj))
+        update(obj)
+    elif isinstance(obj, ImmutableSortedDict):
+        update(b'D%d:' % len(obj))
+        for key, val in obj.items():
+            _encode(key, update)
+            _encode(val, update)
+    elif isinstance(obj, (ImmutableList, tuple)):
+        update(b'L%d:' % len(obj) if isinstance(obj, ImmutableList) else b'T%d:' % len(obj))
+        for val in obj:
+            _encode(val, update)
+    elif isinstance(obj, FrozenArray):
+        update(f'A{obj.dtype.str}{obj.shape}:'.encode())
+        for block in obj.iter_bytes():
+            update(block)
+    elif isinstance(obj, (numbers.Number, np.generic)) and not isinstance(obj, np.void):
+        _encode_number(obj, update)
+    elif isinstance(obj, frozenset):
+        # equal sets may iterate in different orders
+        parts = []
+        for val in obj:
+            h = hashlib.blake2b(digest_size=16)
+            _encode(val, h.update)
+            parts.append(h.digest())
+        update(b'Z%d:' % len(parts))
+        update(b''.join(sorted(parts)))
+    else:
+        data = pickle.dumps(obj, protocol=4)
+        update(b'P%d:' % len(data))
+        update(data)
+
+
+def _encode_number(obj: Any, update: Callable[[bytes], None]):
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, complex):
+        if obj.imag:
+            update(b'C' + struct.pack('<dd', obj.real, obj.imag))
+            return
+        obj = obj.real
+    if isinstance(obj, numbers.Integral):
+        update(b'I%d;' % int(obj))
+    elif isinstance(obj, float) and obj.is_integer():
+        update(b'I%d;' % int(obj))
+    elif isinstance(obj, numbers.Real):
+        update(b'F' + struct.pack('<d', float(obj)))
+    else:
+        data = pickle.dumps(obj, protocol=4)
+        update(b'P%d:' % len(data))
+        update(data)
+
+
+def content_hash(obj: Any) -> bytes:
+    """Returns a 16 byte digest of a canonical encoding of obj, stable across processes and runs.
+
+    Unlike hash(), it does not depend on PYTHONHASHSEED. Like hash(), objects that compare equal
+    get the same digest.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    _encode(obj, h.update)
+    return h.digest()
+
+
+class BloomFilter:
+    """A Bloom filter over content hashes.
+
+    Parameters
+    ----------
+    capacity : int
+        the number of items the filter is sized for.
+    error_rate : float
+        the false positive rate at capacity.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError(f'Invalid Bloom filter capacity {capacity} or error rate {error_rate}')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        n_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.n_bits = max(8, n_bits)
+        self.n_hashes = max(1, int(round(self.n_bits / capacity * math.log(2))))
+        self._bits = bytearray((self.n_bits + 7) // 8)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(capacity={self.capacity}, ' \
+               f'error_rate={self.error_rate}, n_bits={self.n_bits}, n_hashes={self.n_hashes})'
+
+    def _positions(self, digest: bytes) -> Iterator[int]:
+        # double hashing on the two halves of the digest
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        n_bits = self.n_bits
+        for i in range(self.n_hashes):
+            yield (h1 + i * h2) % n_bits
+
+    def add(self, digest: bytes):
+        bits = self._bits
+        for pos in self._positions(digest):
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest: bytes) -> bool:
+        bits = self._bits
+        for pos in self._positions(digest):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def to_bytes(self) -> bytes:
+        return bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, capacity: int, error_rate: float) -> 'BloomFilter':
+        inst = cls(capacity, error_rate)
+        if len(data) != len(inst._bits):
+            raise ValueError('Bloom filter data does not match its parameters')
+        inst._bits = bytearray(data)
+        return inst
+
+
+class SQLiteDatabase(Generic[T]):
+    """A Database whose objects are stored in an SQLite file instead of memory.
+
+    Objects are pickled and keyed by their content hash (see content_hash), together with their
+    frequency and last time stamp. Only a bounded LRU of the frequencies and time stamps of
+    recently used objects (which answers membership, freq() and time stamp lookups), a Bloom filter
+    over the content hashes and the counters stay in memory. Membership checks ask the Bloom
+    filter first, so most misses never reach the file. Sorted indices (keep_sorted_list_of) are
+    SQL indices over columns holding obj[key].
+
+    The insertion log of Database is not kept: the time stamp of an object is the one of its last
+    add, and positional access is not supported.
+
+    Adds are grouped in transactions of commit_every adds; commit() or close() makes them durable.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        the SQLite file, created if it does not exist.
+    keep_sorted_list_of : Iterable[str]
+        the keys to index. Must be the same every time the file is opened.
+    cache_size : int
+        the number of objects whose frequency and time stamp are kept in the LRU.
+    expected_size : int
+        the number of unique objects the Bloom filter is sized for, it is rebuilt twice as large
+        when exceeded.
+    bloom_error : float
+        the false positive rate of the Bloom filter.
+    commit_every : int
+        the number of adds per transaction.
+    """
+
+    def __init__(self, path: Union[str, Path], keep_sorted_list_of: Iterable[str] = None,
+                 cache_size: int = 65536, expected_size: int = 1000000,
+                 bloom_error: float = 0.01, commit_every: int = 10000):
+        self._path = Path(path)
+        self._keys = list(keep_sorted_list_of or [])
+        self._columns = [f'key_{i}' for i in range(len(self._keys))]
+        self._cache_size = cache_size
+        # digest -> [freq, last_ts]
+        self._cache: 'OrderedDict[bytes, List[int]]' = OrderedDict()
+        self._bloom_error = bloom_error
+        self._commit_every = commit_every
+        self._n_pending = 0
+
+        self._conn = sqlite3.connect(str(self._path))
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_tables()
+
+        self._tot_freq = int(self._get_meta('tot_freq', 0))
+        self._n_unique = self._conn.execute('SELECT COUNT(*) FROM objects').fetchone()[0]
+        self._last_ts = int(self._get_meta('last_ts', 0))
+        self._load_bloom(max(expected_size, 2 * self._n_unique))
+
+    def __enter__(self) -> 'SQLiteDatabase[T]':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _create_tables(self):
+        key_columns = ''.join(f', {col}' for col in self._columns)
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS objects (uid INTEGER PRIMARY KEY, '
+                           f'hash BLOB UNIQUE NOT NULL, data BLOB NOT NULL, freq INTEGER NOT NULL, '
+                           f'last_ts INTEGER NOT NULL{key_columns})')
+        for col in self._columns:
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS index_{col} ON objects ({col})')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value)')
+
+        keys = self._get_meta('keys')
+        if keys is None:
+            self._set_meta('keys', pickle.dumps(self._keys))
+            self._conn.commit()
+        elif pickle.loads(keys) != self._keys:
+            raise ValueError(f'{self._path} was created with keep_sorted_list_of='
+                             f'{pickle.loads(keys)}, got {self._keys}')
+
+    def _get_meta(self, name: str, default: Any = None) -> Any:
+        row = self._conn.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, name: str, value: Any):
+        self._conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (name, value))
+
+    def _load_bloom(self, capacity: int):
+        data = self._get_meta('bloom')
+        if data is not None and self._get_meta('bloom_n_unique') == self._n_unique:
+            self._bloom = BloomFilter.from_bytes(data, self._get_meta('bloom_capacity'),
+                                                 self._get_meta('bloom_error'))
+        else:
+            self._rebuild_bloom(capacity)
+
+    def _rebuild_bloom(self, capacity: int):
+        self._bloom = BloomFilter(capacity, self._bloom_error)
+        for digest, in self._conn.execute('SELECT hash FROM objects'):
+            self._bloom.add(digest)
+
+    def _cache_put(self, digest: bytes, freq: int, last_ts: int) -> List[int]:
+        entry = self._cache[digest] = [freq, last_ts]
+        self._cache.move_to_end(digest)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return entry
+
+    def _lookup(self, digest: bytes) -> Optional[List[int]]:
+        """Returns the [freq, last_ts] of the given digest, or None if it was never added."""
+        entry = self._cache.get(digest)
+        if entry is not None:
+            self._cache.move_to_end(digest)
+            return entry
+        if digest not in self._bloom:
+            return None
+        row = self._conn.execute('SELECT freq, last_ts FROM objects WHERE hash = ?',
+                                 (digest,)).fetchone()
+        if row is None:
+            return None
+        return self._cache_put(digest, *row)
+
+    def _now(self) -> int:
+        # time stamps are clamped to be non-decreasing, as in Database.
+        self._last_ts = max(_to_us(datetime.utcnow()), self._last_ts)
+        return self._last_ts
+
+    def add(self, dsn: T):
+        self.extend([dsn])
+
+    def extend(self, designs: Sequence[T]):
+        """Adds the given objects, which all get the same time stamp."""
+        ts = self._now()
+        inserts, updates = [], []
+        batch = {}
+        entries = {}
+        for dsn in designs:
+            digest = content_hash(dsn)
+            if digest in batch:
+                batch[digest] += 1
+                continue
+            batch[digest] = 1
+            entry = self._lookup(digest)
+            if entry is not None:
+                updates.append(digest)
+            else:
+                inserts.append((digest, dsn))
+                self._bloom.add(digest)
+                entry = self._cache_put(digest, 0, ts)
+            entries[digest] = entry
+        # the entries stay valid even if the batch evicted them from the LRU
+        for digest, entry in entries.items():
+            entry[0] += batch[digest]
+            entry[1] = ts
+
+        conn = self._conn
+        if inserts:
+            placeholders = ', ?' * len(self._columns)
+            conn.executemany(f'INSERT INTO objects (hash, data, freq, last_ts'
+                             f'{"".join(", " + c for c in self._columns)}) '
+                             f'VALUES (?, ?, ?, ?{placeholders})',
+                             [(d, pickle.dumps(dsn, protocol=pickle.HIGHEST_PROTOCOL),
+                               batch[d], ts, *(dsn[k] for k in self._keys))
+                              for d, dsn in inserts])
+        if updates:
+            conn.executemany('UPDATE objects SET freq = freq + ?, last_ts = ? WHERE hash = ?',
+                             [(batch[d], ts, d) for d in updates])
+
+        self._n_unique += len(inserts)
+        self._tot_freq += len(designs)
+        self._n_pending += len(designs)
+        if self._n_unique > self._bloom.capacity:
+            self._rebuild_bloom(2 * self._bloom.capacity)
+        if self._n_pending >= self._commit_every:
+            self.commit()
+
+    def commit(self):
+        """Commits the pending adds."""
+        self._set_meta('tot_freq', self._tot_freq)
+        self._set_meta('last_ts', self._last_ts)
+        self._conn.commit()
+        self._n_pending = 0
+
+    def close(self):
+        if self._conn is None:
+            return
+        self._set_meta('bloom', self._bloom.to_bytes())
+        self._set_meta('bloom_capacity', self._bloom.capacity)
+        self._set_meta('bloom_error', self._bloom.error_rate)
+        self._set_meta('bloom_n_unique', self._n_unique)
+        self.commit()
+        self._conn.close()
+        self._conn = None
+
+    def __len__(self):
+        return self._tot_freq
+
+    def __contains__(self, item: T):
+        return self._lookup(content_hash(item)) is not None
+
+    def __iter__(self) -> Iterator[T]:
+        """Iterates over the unique objects in first insertion order, streaming from the file."""
+        cursor = self._conn.execute('SELECT data FROM objects ORDER BY uid')
+        return (pickle.loads(data) for data, in cursor)
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}[{len(self)} elements ({self.n_unique} unique), ' \
+               f'{self._path}]'
+
+    def __getitem__(self, item: T) -> datetime:
+        """Returns the time stamp of the last add of the given object."""
+        entry = self._lookup(content_hash(item))
+        if entry is None:
+            raise KeyError(item)
+        return _from_us(entry[1])
+
+    def freq(self, item: T) -> int:
+        """Returns the number of times the given object was added."""
+        entry = self._lookup(content_hash(item))
+        return 0 if entry is None else entry[0]
+
+    def _column(self, key: str) -> str:
+        if key not in self._keys:
+            raise ValueError(f'{key} is not in the sorted lists. Valid keys are: {self._keys}')
+        return self._columns[self._keys.index(key)]
+
+    def top_k(self, key: str, k: int, largest: bool = False) -> List[T]:
+        """Returns the k objects with the smallest (or largest) obj[key], best first."""
+        col = self._column(key)
+        order = 'DESC' if largest else 'ASC'
+        cursor = self._conn.execute(f'SELECT data FROM objects ORDER BY {col} {order} LIMIT ?',
+                                    (k,))
+        return [pickle.loads(data) for data, in cursor]
+
+    def range(self, key: str, lo: Any = None, hi: Any = None) -> List[T]:
+        """Returns the objects with lo <= obj[key] <= hi in sorted order."""
+        col = self._column(key)
+        where, args = [], []
+        if lo is not None:
+            where.append(f'{col} >= ?')
+            args.append(lo)
+        if hi is not None:
+            where.append(f'{col} <= ?')
+            args.append(hi)
+        clause = f' WHERE {" AND ".join(where)}' if where else ''
+        cursor = self._conn.execute(f'SELECT data FROM objects{clause} ORDER BY {col}', args)
+        return [pickle.loads(data) for data, in cursor]
+
+    @property
+    def tot_freq(self):
+        return self._tot_freq
+
+    @property
+    def n_unique(self):
+        return self._n_unique
@@ -1,8 +1,34 @@
-from typing import Any, Union, Dict, Mapping
+from __future__ import annotations
+
+from typing import (
+    Any, Union, Dict, Mapping, Iterator, Tuple, Optional, List, BinaryIO, IO, Callable, Hashable,
+    Iterable, NamedTuple
+)
 
 from pathlib import Path
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import (
+    Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+)
+from copy import deepcopy
 
 from ruamel.yaml import YAML
+import io
+import os
+import sys
+import glob
+import time
+import itertools
+import bz2
+import gzip
+import lzma
+import shutil
+import subprocess
+import threading
+import mmap
+import zlib
+import struct
 import pickle
 import h5py
 import numpy as np
@@ -12,25 +38,268 @@ from numbers import Number
 PathLike = Union[str, Path]
 yaml = YAML(typ='safe')
 
-def read_yaml(fname: Union[str, Path]) -> Any:
+_COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+_PARALLEL_COMPRESSORS = {'gzip': 'pigz', 'bz2': 'pbzip2', 'xz': 'xz'}
+
+
+def _get_compression(fpath: Path, compression: Optional[str]) -> Optional[str]:
+    """Returns the codec name given an explicit compression argument or the file suffix."""
+    if compression is None:
+        return _COMPRESSION_SUFFIXES.get(fpath.suffix)
+    if compression == 'none':
+        return None
+    if compression not in _PARALLEL_COMPRESSORS:
+        raise ValueError(f'Unknown compression {compression}, expected one of '
+                         f'{list(_PARALLEL_COMPRESSORS)} or none')
+    return compression
+
+
+def _parallel_codec_args(codec: str, level: Optional[int], threads: int) -> List[str]:
+    if codec == 'bz2':
+        args = [f'-p{threads}']
+    elif codec == 'xz':
+        args = ['-T', str(threads)]
+    else:
+        args = ['-p', str(threads)]
+    if level is not None:
+        args.append(f'-{level}')
+    return args
+
+
+@contextmanager
+def _open_stream(fpath: Path, mode: str, compression: Optional[str] = None,
+                 level: Optional[int] = None, threads: int = 1) -> Iterator[IO]:
+    """Opens the given file, streaming through a compressor if needed.
+
+    Parameters
+    ----------
+    fpath : Path
+        the file name.
+    mode : str
+        one of 'r', 'w', 'rb' or 'wb'.
+    compression : Optional[str]
+        'gzip', 'bz2', 'xz' or 'none'. If None, it is inferred from the file suffix.
+    level : Optional[int]
+        the compression level, None to use the codec default.
+    threads : int
+        If greater than 1 and the codec's parallel command line tool (pigz, pbzip2 or xz) is
+        available, the data is piped through it using this many threads.
+    """
+    codec = _get_compression(fpath, compression)
+    if codec is None:
+        with open(fpath, mode) as f:
+            yield f
+        return
+
+    exe = shutil.which(_PARALLEL_COMPRESSORS[codec]) if threads > 1 else None
+    if exe is None:
+        opener = dict(gzip=gzip.open, bz2=bz2.open, xz=lzma.open)[codec]
+        mode_t = mode if mode.endswith('b') else mode + 't'
+        if level is None or mode.startswith('r'):
+            kwargs = {}
+        else:
+            kwargs = {'preset' if codec == 'xz' else 'compresslevel': level}
+        with opener(fpath, mode_t, **kwargs) as f:
+            yield f
+        return
+
+    args = [exe] + _parallel_codec_args(codec, level, threads)
+    if mode.startswith('r'):
+        proc = subprocess.Popen(args + ['-d', '-c', str(fpath)], stdout=subprocess.PIPE)
+        pipe = proc.stdout
+        raw = None
+    else:
+        raw = open(fpath, 'wb')
+        proc = subprocess.Popen(args + ['-c'], stdin=subprocess.PIPE, stdout=raw)
+        pipe = proc.stdin
+    stream = pipe if mode.endswith('b') else io.TextIOWrapper(pipe)
+    try:
+        yield stream
+    finally:
+        stream.close()
+        retcode = proc.wait()
+        if raw is not None:
+            raw.close()
+    if retcode:
+        raise OSError(f'{args[0]} failed with exit code {retcode} on {fpath}')
+
+
+class FileCache:
+    """A process-level LRU cache of parsed files.
+
+    Entries are keyed by the resolved path (and the reader options) and are only returned while
+    the file's (mtime, size, inode) signature is unchanged. Each entry is charged an estimate of the
+    memory its parsed content takes (see _content_nbytes), not the size of the file, which may be
+    compressed. Files written through this module's writers are invalidated automatically.
+
+    Parameters
+    ----------
+    max_bytes : int
+        the estimated total size of the cached contents above which the least recently used
+        entries are evicted.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 2 ** 20) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._nbytes = 0
+        self._entries: OrderedDict[Tuple[Path, Hashable], Tuple[Tuple[int, int, int], Any, int]] \
+            = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def info(self) -> Dict[str, int]:
+        """Returns the hit/miss/eviction counters and the current size of the cache."""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), nbytes=self._nbytes, max_bytes=self.max_bytes)
+
+    def load(self, fname: PathLike, key: Hashable, loader: Callable[[], Any],
+             copy: bool = False) -> Any:
+        """Returns the cached content of the given file, calling loader on a miss.
+
+        Parameters
+        ----------
+        fname : PathLike
+            the file name.
+        key : Hashable
+            identifies the reader and its options, so the same file read differently is cached
+            separately.
+        loader : Callable[[], Any]
+            reads and parses the file.
+        copy : bool
+            If True, returns a deep copy of the cached object, so the caller may modify it.
+
+        Returns
+        -------
+        content : Any
+            the parsed content.
+        """
+        path = Path(fname).resolve()
+        st = path.stat()
+        sig = (st.st_mtime_ns, st.st_size, st.st_ino)
+        entry_key = (path, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and entry[0] == sig:
+                self._entries.move_to_end(entry_key)
+                self.hits += 1
+                return deepcopy(entry[1]) if copy else entry[1]
+            self.misses += 1
+
+        content = loader()
+        nbytes = max(_content_nbytes(content), 1)
+        with self._lock:
+            self._pop(entry_key)
+            if nbytes <= self.max_bytes:
+                self._entries[entry_key] = (sig, content, nbytes)
+                self._nbytes += nbytes
+                while self._nbytes > self.max_bytes:
+                    self._pop(next(iter(self._entries)))
+                    self.evictions += 1
+
+        return deepcopy(content) if copy else content
+
+    def invalidate(self, fname: PathLike) -> None:
+        """Drops every cached entry of the given file."""
+        path = Path(fname).resolve()
+        with self._lock:
+            for entry_key in [k for k in self._entries if k[0] == path]:
+                self._pop(entry_key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _pop(self, entry_key: Tuple[Path, Hashable]) -> None:
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._nbytes -= entry[2]
+
+
+def _content_nbytes(obj: Any) -> int:
+    """Estimates the memory taken by obj and everything it references.
+
+    Arrays and tensors count their data buffers, containers and objects count themselves and
+    their items or attributes. Objects referenced several times are counted once.
+    """
+    total = 0
+    seen = set()
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj, 0)
+        if isinstance(obj, np.ndarray):
+            total += obj.nbytes
+            if obj.dtype.hasobject:
+                stack.extend(obj.ravel())
+        elif hasattr(obj, 'element_size') and hasattr(obj, 'nelement'):
+            # a torch tensor
+            total += obj.element_size() * obj.nelement()
+        elif isinstance(obj, Mapping):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif not isinstance(obj, (str, bytes, bytearray, Number)):
+            if hasattr(obj, '__dict__'):
+                stack.append(vars(obj))
+            for cls in type(obj).__mro__:
+                slots = getattr(cls, '__slots__', ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    if slot != '__dict__' and hasattr(obj, slot):
+                        stack.append(getattr(obj, slot))
+    return total
+
+
+file_cache = FileCache()
+
+
+def read_yaml(fname: Union[str, Path], compression: Optional[str] = None,
+              threads: int = 1, cached: bool = False, copy: bool = False) -> Any:
     """Read the given file using YAML.
 
     Parameters
     ----------
     fname : str
         the file name.
+    compression : Optional[str]
+        'gzip', 'bz2', 'xz' or 'none'. If None, it is inferred from the suffix (.gz, .bz2, .xz).
+    threads : int
+        the number of decompression threads, see write_yaml.
+    cached : bool
+        If True, returns the content from file_cache while the file is unchanged on disk.
+    copy : bool
+        Only used if cached is True. If True, returns a deep copy of the cached content.
 
     Returns
     -------
     content : Any
         the object returned by YAML.
     """
-    with open(fname, 'r') as f:
+    if cached:
+        return file_cache.load(fname, ('yaml', compression),
+                               lambda: read_yaml(fname, compression, threads), copy)
+
+    with _open_stream(Path(fname), 'r', compression, threads=threads) as f:
         content = yaml.load(f)
 
     return content
 
-def write_yaml(fname: Union[str, Path], obj: object, mkdir: bool = True) -> None:
+def write_yaml(fname: Union[str, Path], obj: object, mkdir: bool = True,
+               compression: Optional[str] = None, level: Optional[int] = None,
+               threads: int = 1) -> None:
     """Writes the given object to a file using YAML format.
 
     Parameters
@@ -41,6 +310,13 @@ def write_yaml(fname: Union[str, Path], obj: object, mkdir: bool = True) -> None
         the object to write.
     mkdir : bool
         If True, will create parent directories if they don't exist.
+    compression : Optional[str]
+        'gzip', 'bz2', 'xz' or 'none'. If None, it is inferred from the suffix (.gz, .bz2, .xz).
+    level : Optional[int]
+        the compression level, None to use the codec default.
+    threads : int
+        If greater than 1, compresses in parallel through pigz / pbzip2 / xz when they are
+        installed. Falls back to the single threaded standard library codecs otherwise.
 
     Returns
     -------
@@ -55,8 +331,9 @@ def write_yaml(fname: Union[str, Path], obj: object, mkdir: bool = True) -> None
     if mkdir:
         fpath.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(fpath, 'w') as f:
+    with _open_stream(fpath, 'w', compression, level, threads) as f:
         yaml.dump(obj, f)
+    file_cache.invalidate(fpath)
 
 def get_full_name(name: str, prefix: str = '', suffix: str = ''):
     """Returns a full name given a base name and prefix and suffix extensions
@@ -81,27 +358,183 @@ def get_full_name(name: str, prefix: str = '', suffix: str = ''):
         name = f'{name}_{suffix}'
     return name
 
-def read_pickle(fname: Union[str, Path]) -> Any:
+_OOB_MAGIC = b'MLUPKL5\n'
+_OOB_HEADER = struct.Struct('<QQ?')
+_OOB_ENTRY = struct.Struct('<QQ')
+_OOB_ALIGN = 64
+
+
+def _sidecar_path(fpath: Path) -> Path:
+    return fpath.with_name(fpath.name + '.buffers')
+
+
+@contextmanager
+def _replacing(fpath: Path) -> Iterator[Path]:
+    """Yields a temporary path next to fpath, which replaces fpath once the block succeeds.
+
+    The old file is never truncated, so arrays memory-mapped from it by read_pickle stay valid.
+    """
+    tmp = fpath.with_name(f'.{fpath.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        yield tmp
+        os.replace(tmp, fpath)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _OOB_ALIGN) * _OOB_ALIGN
+
+
+def _tensor_from_numpy(arr: np.ndarray) -> Any:
+    import torch
+    return torch.from_numpy(arr)
+
+
+class _OutOfBandPickler(pickle.Pickler):
+    """A protocol 5 pickler that also sends plain CPU torch tensors out-of-band.
+
+    torch does not support out-of-band buffers itself, so tensors are reduced through their numpy
+    view. Tensors that share a storage are written (and loaded) as separate arrays.
+    """
+
+    def reducer_override(self, obj: Any) -> Any:
+        torch = sys.modules.get('torch')
+        if (torch is None or type(obj) is not torch.Tensor or obj.requires_grad or
+                obj.device.type != 'cpu' or obj.layout != torch.strided):
+            return NotImplemented
+        try:
+            return _tensor_from_numpy, (obj.numpy(),)
+        except (TypeError, RuntimeError):
+            # dtypes without a numpy equivalent (e.g. bfloat16)
+            return NotImplemented
+
+
+def _write_pickle_oob(fpath: Path, obj: object, sidecar: bool, min_buffer_bytes: int) -> None:
+    buffers: List[memoryview] = []
+
+    def _buffer_callback(buf: pickle.PickleBuffer) -> bool:
+        raw = buf.raw()
+        if raw.nbytes < min_buffer_bytes:
+            return True
+        buffers.append(raw)
+        return False
+
+    payload_io = io.BytesIO()
+    _OutOfBandPickler(payload_io, protocol=5, buffer_callback=_buffer_callback).dump(obj)
+    payload = payload_io.getbuffer()
+
+    header_size = (len(_OOB_MAGIC) + _OOB_HEADER.size + _OOB_ENTRY.size * len(buffers) +
+                   len(payload))
+    offset = 0 if sidecar else header_size
+    table = []
+    for raw in buffers:
+        offset = _align(offset)
+        table.append((offset, raw.nbytes))
+        offset += raw.nbytes
+
+    def _write_buffers(f: BinaryIO) -> None:
+        for (offset, _), raw in zip(table, buffers):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(raw)
+
+    if sidecar:
+        with _replacing(_sidecar_path(fpath)) as tmp, open(tmp, 'wb') as f:
+            _write_buffers(f)
+
+    with _replacing(fpath) as tmp, open(tmp, 'wb') as f:
+        f.write(_OOB_MAGIC)
+        f.write(_OOB_HEADER.pack(len(payload), len(buffers), sidecar))
+        for entry in table:
+            f.write(_OOB_ENTRY.pack(*entry))
+        f.write(payload)
+        if not sidecar:
+            _write_buffers(f)
+
+
+def _read_pickle_oob(fpath: Path, f: BinaryIO, use_mmap: bool) -> Any:
+    payload_len, n_buffers, sidecar = _OOB_HEADER.unpack(f.read(_OOB_HEADER.size))
+    table = [_OOB_ENTRY.unpack(f.read(_OOB_ENTRY.size)) for _ in range(n_buffers)]
+    payload = f.read(payload_len)
+    if not n_buffers:
+        return pickle.loads(payload)
+
+    if sidecar:
+        with open(_sidecar_path(fpath), 'rb') as bf:
+            return _load_with_buffers(payload, table, bf, use_mmap)
+    return _load_with_buffers(payload, table, f, use_mmap)
+
+
+def _load_with_buffers(payload: bytes, table: List[Tuple[int, int]], f: BinaryIO,
+                       use_mmap: bool) -> Any:
+    if use_mmap:
+        # the memoryviews keep the mapping alive after the file is closed.
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        buffers = [view[offset:offset + nbytes] for offset, nbytes in table]
+    else:
+        buffers = []
+        for offset, nbytes in table:
+            f.seek(offset)
+            buf = bytearray(nbytes)
+            f.readinto(buf)
+            buffers.append(buf)
+    return pickle.loads(payload, buffers=buffers)
+
+
+def read_pickle(fname: Union[str, Path], mmap: bool = True, compression: Optional[str] = None,
+                threads: int = 1, cached: bool = False, copy: bool = False) -> Any:
     """Read the given file using Pickle.
 
+    Files written with write_pickle(..., out_of_band=True) are detected automatically.
+
     Parameters
     ----------
     fname : str
         the file name.
+    mmap : bool
+        Only used for out-of-band files. If True, the out-of-band buffers are memory-mapped
+        instead of read, so arrays are loaded without copies but are read-only.
+    compression : Optional[str]
+        'gzip', 'bz2', 'xz' or 'none'. If None, it is inferred from the suffix (.gz, .bz2, .xz).
+    threads : int
+        the number of decompression threads, see write_yaml.
+    cached : bool
+        If True, returns the content from file_cache while the file is unchanged on disk.
+    copy : bool
+        Only used if cached is True. If True, returns a deep copy of the cached content.
 
     Returns
     -------
     content : Any
         the object returned by pickle.
     """
-    with open(fname, 'rb') as f:
+    if cached:
+        return file_cache.load(fname, ('pickle', mmap, compression),
+                               lambda: read_pickle(fname, mmap, compression, threads), copy)
+
+    fpath = Path(fname)
+    if _get_compression(fpath, compression) is not None:
+        with _open_stream(fpath, 'rb', compression, threads=threads) as f:
+            return pickle.load(f)
+
+    with open(fpath, 'rb') as f:
+        if f.read(len(_OOB_MAGIC)) == _OOB_MAGIC:
+            return _read_pickle_oob(fpath, f, mmap)
+        f.seek(0)
         content = pickle.load(f)
 
     return content
 
-def write_pickle(fname: Union[str, Path], obj: object, mkdir: bool = True) -> None:
+def write_pickle(fname: Union[str, Path], obj: object, mkdir: bool = True,
+                 out_of_band: bool = False, sidecar: bool = False,
+                 min_buffer_bytes: int = 64 * 1024, compression: Optional[str] = None,
+                 level: Optional[int] = None, threads: int = 1) -> None:
     """Writes the given object to a file using pickle format.
 
+    The file (and its sidecar) is written to a temporary file and then renamed into place, so
+    arrays memory-mapped from a previous version of it stay valid.
+
     Parameters
     ----------
     fname : Union[str, Path]
@@ -110,6 +543,22 @@ def write_pickle(fname: Union[str, Path], obj: object, mkdir: bool = True) -> No
         the object to write.
     mkdir : bool
         If True, will create parent directories if they don't exist.
+    out_of_band : bool
+        If True, uses pickle protocol 5 and writes large buffers (e.g. contiguous numpy arrays and
+        CPU torch tensors) as raw, 64-byte aligned blocks after the pickle stream, so read_pickle
+        can memory-map them instead of copying.
+    sidecar : bool
+        Only used if out_of_band is True. If True, the buffers are written to a separate
+        '<fname>.buffers' file instead.
+    min_buffer_bytes : int
+        Only used if out_of_band is True. Buffers smaller than this are kept in the pickle stream.
+    compression : Optional[str]
+        'gzip', 'bz2', 'xz' or 'none'. If None, it is inferred from the suffix (.gz, .bz2, .xz).
+        Cannot be combined with out_of_band.
+    level : Optional[int]
+        the compression level, None to use the codec default.
+    threads : int
+        the number of compression threads, see write_yaml.
 
     Returns
     -------
@@ -124,40 +573,614 @@ def write_pickle(fname: Union[str, Path], obj: object, mkdir: bool = True) -> No
     if mkdir:
         fpath.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(fpath, 'wb') as f:
-        pickle.dump(obj, f)
+    codec = _get_compression(fpath, compression)
+    if out_of_band:
+        if codec is not None:
+            raise ValueError('Out-of-band buffers cannot be memory-mapped from a compressed file')
+        _write_pickle_oob(fpath, obj, sidecar, min_buffer_bytes)
+    else:
+        with _replacing(fpath) as tmp, _open_stream(tmp, 'wb', codec or 'none', level,
+                                                    threads) as f:
+            pickle.dump(obj, f)
+    file_cache.invalidate(fpath)
+
+
+_RECORD_HEADER = struct.Struct('<II')
+
+
+def pack_record(payload: bytes) -> bytes:
+    """Frames payload as a record of an append-only file: a (length, crc32) header, then payload.
+
+    Parameters
+    ----------
+    payload : bytes
+        the record content.
+
+    Returns
+    -------
+    record : bytes
+        the bytes to append to the file.
+    """
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(f: BinaryIO) -> Iterator[Tuple[int, bytes]]:
+    """Reads the records written with pack_record, from the current position of f.
+
+    Reading stops at the first incomplete or corrupt record, e.g. one torn by a crash or still
+    being appended, so the file can be truncated to the last yielded offset before appending.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        the file, opened in binary mode.
+
+    Yields
+    ------
+    offset : int
+        the position in f right after the record.
+    payload : bytes
+        the record content.
+    """
+    offset = f.tell()
+    while True:
+        header = f.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return
+        size, crc = _RECORD_HEADER.unpack(header)
+        payload = f.read(size)
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            return
+        offset += _RECORD_HEADER.size + size
+        yield offset, payload
+
+
+def _read_hdf5_group(root: h5py.Group) -> Dict[str, Any]:
+    init_dict = {}
+    for k, v in root.items():
+        if isinstance(v, h5py.Dataset):
+            init_dict[k] = np.array(v)
+        elif isinstance(v, h5py.Group):
+            init_dict[k] = _read_hdf5_group(v)
+        else:
+            raise ValueError(f'Does not support type {type(v)}')
+    return init_dict
+
+
+def _can_memmap(dset: h5py.Dataset) -> bool:
+    """Returns True if the dataset is stored as one contiguous, unfiltered block of plain data."""
+    if dset.chunks is not None or dset.compression is not None or dset.external:
+        return False
+    if dset.dtype.hasobject or dset.dtype.kind in ('O', 'V') or h5py.check_dtype(vlen=dset.dtype):
+        return False
+    return dset.ndim > 0 and dset.size > 0 and dset.id.get_offset() is not None
+
+
+class HDF5LazyDataset:
+    """A lazy handle to an HDF5 dataset.
+
+    Nothing is read until the dataset is indexed, in which case h5py only reads the chunks that
+    overlap the selection.
+
+    Parameters
+    ----------
+    dset : h5py.Dataset
+        the underlying dataset, its file must stay open while this handle is used.
+    """
+
+    def __init__(self, dset: h5py.Dataset) -> None:
+        self._dset = dset
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(name={self._dset.name!r}, shape={self.shape}, ' \
+               f'dtype={self.dtype})'
 
+    def __len__(self) -> int:
+        return len(self._dset)
 
-def read_hdf5(fpath: PathLike) -> Dict[str, Any]:
-    def _load_hdf5_helper(root: h5py.Group) -> Dict[str, Any]:
-        init_dict = {}
-        for k, v in root.items():
-            if isinstance(v, h5py.Dataset):
-                init_dict[k] = np.array(v)
-            elif isinstance(v, h5py.Group):
-                init_dict[k] = _load_hdf5_helper(v)
+    def __getitem__(self, idx: Any) -> Any:
+        return self._dset[idx]
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> np.ndarray:
+        arr = self.load()
+        return arr if dtype is None else arr.astype(dtype, copy=False)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._dset.shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dset.dtype
+
+    @property
+    def ndim(self) -> int:
+        return self._dset.ndim
+
+    @property
+    def size(self) -> int:
+        return self._dset.size
+
+    @property
+    def chunks(self) -> Optional[Tuple[int, ...]]:
+        """the chunk shape, None if the dataset is contiguous."""
+        return self._dset.chunks
+
+    def load(self) -> np.ndarray:
+        """Reads the whole dataset into memory."""
+        return np.array(self._dset)
+
+
+class HDF5LazyGroup(Mapping):
+    """A read-only mapping view of an HDF5 group with the same layout as read_hdf5's dictionary.
+
+    Sub-groups are returned as HDF5LazyGroup and datasets are only opened when accessed. If memmap
+    is True, contiguous and uncompressed datasets are returned as read-only np.memmap views of the
+    file (zero-copy), every other dataset is returned as an HDF5LazyDataset.
+
+    Parameters
+    ----------
+    group : h5py.Group
+        the underlying group.
+    fpath : PathLike
+        path of the file the group lives in, used to create memory maps.
+    memmap : bool
+        True to return contiguous datasets as np.memmap.
+    """
+
+    def __init__(self, group: h5py.Group, fpath: PathLike, memmap: bool = True) -> None:
+        self._group = group
+        self._fpath = fpath
+        self._memmap = memmap
+        self._cache: Dict[str, Any] = {}
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}(name={self._group.name!r}, keys={list(self)})'
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self._cache:
+            return self._cache[key]
+
+        v = self._group[key]
+        if isinstance(v, h5py.Group):
+            ans = HDF5LazyGroup(v, self._fpath, self._memmap)
+        elif isinstance(v, h5py.Dataset):
+            if self._memmap and _can_memmap(v):
+                ans = np.memmap(self._fpath, dtype=v.dtype, mode='r', offset=v.id.get_offset(),
+                                shape=v.shape)
+            elif v.ndim == 0:
+                ans = np.array(v)
             else:
-                raise ValueError(f'Does not support type {type(v)}')
-        return init_dict
+                ans = HDF5LazyDataset(v)
+        else:
+            raise ValueError(f'Does not support type {type(v)}')
+
+        self._cache[key] = ans
+        return ans
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._group.keys())
+
+    def __len__(self) -> int:
+        return len(self._group)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._group
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Reads everything under this group into a nested dictionary, same as read_hdf5."""
+        return _read_hdf5_group(self._group)
+
+
+class HDF5LazyFile(HDF5LazyGroup):
+    """The root group of a lazily read HDF5 file.
+
+    The file stays open until close() is called, use it as a context manager to close it
+    automatically. Memory maps handed out before closing remain valid.
+
+    Parameters
+    ----------
+    fpath : PathLike
+        the file name.
+    memmap : bool
+        True to return contiguous datasets as np.memmap.
+    """
+
+    def __init__(self, fpath: PathLike, memmap: bool = True) -> None:
+        self._file = h5py.File(fpath, 'r')
+        HDF5LazyGroup.__init__(self, self._file, fpath, memmap)
+
+    def __enter__(self) -> HDF5LazyFile:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    @property
+    def closed(self) -> bool:
+        return not self._file.id.valid
+
+    def close(self) -> None:
+        self._cache.clear()
+        self._file.close()
+
+
+def read_hdf5(fpath: PathLike, lazy: bool = False, memmap: bool = True, cached: bool = False,
+              copy: bool = False) -> Union[Dict[str, Any], HDF5LazyFile]:
+    """Read the given HDF5 file into a nested dictionary.
+
+    Parameters
+    ----------
+    fpath : PathLike
+        the file name.
+    lazy : bool
+        If True, returns an HDF5LazyFile instead, which only reads datasets when they are accessed.
+        The caller is responsible for closing it.
+    memmap : bool
+        Only used if lazy is True. If True, contiguous uncompressed datasets are returned as
+        read-only np.memmap views.
+    cached : bool
+        If True, returns the content from file_cache while the file is unchanged on disk. Cannot
+        be combined with lazy.
+    copy : bool
+        Only used if cached is True. If True, returns a deep copy of the cached content.
+
+    Returns
+    -------
+    content : Union[Dict[str, Any], HDF5LazyFile]
+        the nested dictionary of numpy arrays, or a lazy mapping with the same layout.
+    """
+    if lazy:
+        if cached:
+            raise ValueError('Lazy HDF5 files hold an open file handle and cannot be cached')
+        return HDF5LazyFile(fpath, memmap=memmap)
+    if cached:
+        return file_cache.load(fpath, 'hdf5', lambda: read_hdf5(fpath), copy)
 
     with h5py.File(fpath, 'r') as f:
-        return _load_hdf5_helper(f)
+        return _read_hdf5_group(f)
 
 
+def _write_hdf5_group(obj: Mapping[str, Union[Mapping, np.ndarray]], root: h5py.Group,
+                      **dset_kwargs: Any) -> None:
+    for k, v in obj.items():
+        if isinstance(v, np.ndarray):
+            kwargs = dset_kwargs if v.ndim > 0 else {}
+            root.create_dataset(name=k, data=v, **kwargs)
+        elif isinstance(v, dict):
+            grp = root.create_group(name=k)
+            _write_hdf5_group(v, grp, **dset_kwargs)
+        elif isinstance(v, Number):
+            root.create_dataset(name=k, data=v)
+        else:
+            raise ValueError(f'Does not support type {type(v)}')
+
 
 def write_hdf5(data_dict: Mapping[str, Any], fpath: PathLike) -> None:
+    with h5py.File(fpath, 'w') as root:
+        _write_hdf5_group(data_dict, root)
+    file_cache.invalidate(fpath)
+
+
+def _auto_chunks(row_shape: Tuple[int, ...], itemsize: int,
+                 target_bytes: int = 256 * 1024) -> Tuple[int, ...]:
+    """Returns a chunk shape of whole rows that is roughly target_bytes large."""
+    row_bytes = max(int(np.prod(row_shape, dtype=np.int64)) * itemsize, 1)
+    return (max(target_bytes // row_bytes, 1),) + tuple(row_shape)
+
+
+class HDF5Writer:
+    """Incrementally writes nested datasets into an HDF5 file.
+
+    Datasets are created on their first append as chunked datasets that are resizable along the
+    first axis, and grow as more rows are appended. Appended rows are buffered in memory until a
+    full chunk is collected, so appending one row at a time is cheap. Dataset names may be nested
+    paths (e.g. 'train/loss'). Once closed, the file can be read back with read_hdf5.
+
+    Parameters
+    ----------
+    fpath : PathLike
+        the file name.
+    compression : Optional[str]
+        default compression filter of appended datasets (e.g. 'gzip' or 'lzf').
+    compression_opts : Any
+        default compression options (e.g. the gzip level).
+    chunks : Optional[Tuple[int, ...]]
+        default chunk shape. If None, a chunk shape of whole rows is chosen automatically.
+    dataset_options : Optional[Mapping[str, Mapping[str, Any]]]
+        per dataset overrides of compression, compression_opts, chunks and shuffle, keyed by the
+        dataset name.
+    flush_every : int
+        the number of appends after which buffered rows are written and the file is flushed.
+        0 to only flush on close() or flush().
+    mode : str
+        'w' to truncate the file, 'a' to add to an existing file. Appending to a dataset that is
+        already in the file requires it to be chunked and resizable along the first axis.
+    mkdir : bool
+        If True, will create parent directories if they don't exist.
+    """
+
+    def __init__(self, fpath: PathLike, compression: Optional[str] = None,
+                 compression_opts: Any = None, chunks: Optional[Tuple[int, ...]] = None,
+                 dataset_options: Optional[Mapping[str, Mapping[str, Any]]] = None,
+                 flush_every: int = 0, mode: str = 'w', mkdir: bool = True) -> None:
+        fpath = Path(fpath)
+        if mkdir:
+            fpath.parent.mkdir(parents=True, exist_ok=True)
+
+        self._fpath = fpath
+        self._defaults = dict(compression=compression, compression_opts=compression_opts,
+                              chunks=chunks)
+        self._dset_options = dict(dataset_options or {})
+        self._flush_every = flush_every
+        self._file = h5py.File(fpath, mode)
+        self._buffers: Dict[str, List[np.ndarray]] = {}
+        self._buffered_rows: Dict[str, int] = {}
+        self._n_appends = 0
+
+    def __enter__(self) -> HDF5Writer:
+        return self
 
-    def _save_as_hdf5_helper(obj: Mapping[str, Union[Mapping, np.ndarray]], root: h5py.File):
-        for k, v in obj.items():
-            if isinstance(v, np.ndarray):
-                root.create_dataset(name=k, data=v)
-            elif isinstance(v, dict):
-                grp = root.create_group(name=k)
-                _save_as_hdf5_helper(v, grp)
-            elif isinstance(v, Number):
-                root.create_dataset(name=k, data=v)
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._buffers or name in self._file
+
+    @property
+    def closed(self) -> bool:
+        return not self._file.id.valid
+
+    def n_rows(self, name: str) -> int:
+        """Returns the number of rows appended to the given dataset so far."""
+        stored = len(self._file[name]) if name in self._file else 0
+        return stored + self._buffered_rows.get(name, 0)
+
+    def append(self, name: str, batch: Any) -> None:
+        """Appends a batch of rows to the given dataset, creating it if needed.
+
+        Parameters
+        ----------
+        name : str
+            the dataset name.
+        batch : Any
+            array-like whose first axis indexes the rows.
+        """
+        batch = np.asarray(batch)
+        if batch.ndim == 0:
+            raise ValueError(f'Cannot append a scalar to {name}, use append_row instead')
+
+        if name not in self._buffers:
+            if name in self._file:
+                self._open_dataset(name)
             else:
-                raise ValueError(f'Does not support type {type(v)}')
+                self._create_dataset(name, batch)
+        dset = self._file[name]
+        if batch.shape[1:] != dset.shape[1:]:
+            raise ValueError(f'Row shape {batch.shape[1:]} does not match the row shape '
+                             f'{dset.shape[1:]} of {name}')
 
-    with h5py.File(fpath, 'w') as root:
-        _save_as_hdf5_helper(data_dict, root)
+        self._buffers[name].append(batch.astype(dset.dtype, copy=False))
+        self._buffered_rows[name] += len(batch)
+        if self._buffered_rows[name] >= dset.chunks[0]:
+            self._write_buffer(name)
+
+        self._n_appends += 1
+        if self._flush_every and self._n_appends % self._flush_every == 0:
+            self.flush()
+
+    def append_row(self, name: str, row: Any) -> None:
+        """Appends a single row to the given dataset, creating it if needed."""
+        self.append(name, np.asarray(row)[np.newaxis])
+
+    def write(self, data_dict: Mapping[str, Any], **dset_kwargs: Any) -> None:
+        """Writes a nested dictionary of fixed datasets at once, same as write_hdf5."""
+        _write_hdf5_group(data_dict, self._file, **dset_kwargs)
+
+    def flush(self) -> None:
+        """Writes all buffered rows and flushes the file to disk."""
+        for name in self._buffers:
+            self._write_buffer(name)
+        self._file.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.flush()
+        self._file.close()
+        file_cache.invalidate(self._fpath)
+
+    def _create_dataset(self, name: str, batch: np.ndarray) -> None:
+        opts = dict(self._defaults)
+        opts.update(self._dset_options.get(name, {}))
+        row_shape = batch.shape[1:]
+        if opts['chunks'] is None:
+            opts['chunks'] = _auto_chunks(row_shape, batch.dtype.itemsize)
+        self._file.create_dataset(name, shape=(0,) + row_shape, maxshape=(None,) + row_shape,
+                                  dtype=batch.dtype, **opts)
+        self._buffers[name] = []
+        self._buffered_rows[name] = 0
+
+    def _open_dataset(self, name: str) -> None:
+        # a dataset already in the file (mode='a', or written with write()) is appended to
+        dset = self._file[name]
+        if not isinstance(dset, h5py.Dataset):
+            raise ValueError(f'{name} is a group, not a dataset')
+        if dset.chunks is None or dset.maxshape[0] is not None:
+            raise ValueError(f'Cannot append to {name}, it is not resizable along the first axis')
+        self._buffers[name] = []
+        self._buffered_rows[name] = 0
+
+    def _write_buffer(self, name: str) -> None:
+        if not self._buffered_rows[name]:
+            return
+        dset = self._file[name]
+        buf = self._buffers[name]
+        data = buf[0] if len(buf) == 1 else np.concatenate(buf, axis=0)
+        start = len(dset)
+        dset.resize(start + len(data), axis=0)
+        dset[start:] = data
+        buf.clear()
+        self._buffered_rows[name] = 0
+
+
+_READERS: Dict[str, Callable[[Path], Any]] = {
+    '.pickle': read_pickle,
+    '.pkl': read_pickle,
+    '.yaml': read_yaml,
+    '.yml': read_yaml,
+    '.h5': read_hdf5,
+    '.hdf5': read_hdf5,
+}
+
+
+class ReadResult(NamedTuple):
+    """The outcome of reading one file with read_many."""
+    path: Path
+    content: Any
+    error: Optional[BaseException]
+    nbytes: int
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _read_one(fpath: Path, reader: Callable[[Path], Any]) -> ReadResult:
+    try:
+        nbytes = fpath.stat().st_size
+        return ReadResult(fpath, reader(fpath), None, nbytes)
+    except Exception as ex:
+        return ReadResult(fpath, None, ex, 0)
+
+
+class BulkReader:
+    """Iterator over the results of read_many, see read_many for the parameters.
+
+    Throughput statistics of the files consumed so far are available through stats().
+    """
+
+    def __init__(self, paths: List[Path], readers: Mapping[str, Callable[[Path], Any]],
+                 ordered: bool, max_workers: int, processes: bool, max_in_flight: int) -> None:
+        self._paths = paths
+        self._readers = readers
+        self._ordered = ordered
+        self._max_workers = max_workers
+        self._processes = processes
+        self._max_in_flight = max_in_flight
+
+        self.n_files = 0
+        self.n_errors = 0
+        self.nbytes = 0
+        self._t_start: Optional[float] = None
+        self._t_last: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def __iter__(self) -> Iterator[ReadResult]:
+        executor_cls = ProcessPoolExecutor if self._processes else ThreadPoolExecutor
+        self._t_start = time.perf_counter()
+        paths = iter(self._paths)
+        pending: Dict[Future, Path] = {}
+        with executor_cls(max_workers=self._max_workers) as executor:
+            try:
+                for fpath in itertools.islice(paths, self._max_in_flight):
+                    pending[self._submit(executor, fpath)] = fpath
+                while pending:
+                    if self._ordered:
+                        fut = next(iter(pending))
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        fut = next(f for f in pending if f in done)
+                    fpath = pending.pop(fut)
+                    for next_path in itertools.islice(paths, 1):
+                        pending[self._submit(executor, next_path)] = next_path
+                    yield self._record(fut, fpath)
+            finally:
+                for fut in pending:
+                    fut.cancel()
+
+    def _submit(self, executor: Executor, fpath: Path) -> Future:
+        return executor.submit(_read_one, fpath, self._get_reader(fpath))
+
+    def _get_reader(self, fpath: Path) -> Callable[[Path], Any]:
+        suffixes = fpath.suffixes
+        if suffixes and suffixes[-1] in _COMPRESSION_SUFFIXES:
+            suffixes = suffixes[:-1]
+        suffix = suffixes[-1] if suffixes else ''
+        return self._readers.get(suffix, _unknown_reader)
+
+    def _record(self, fut: Future, fpath: Path) -> ReadResult:
+        try:
+            result = fut.result()
+        except Exception as ex:
+            # the worker itself failed (e.g. a broken process pool or an unpicklable result).
+            result = ReadResult(fpath, None, ex, 0)
+        self.n_files += 1
+        self.nbytes += result.nbytes
+        if not result.ok:
+            self.n_errors += 1
+        self._t_last = time.perf_counter()
+        return result
+
+    def stats(self) -> Dict[str, float]:
+        """Returns the number of files and bytes read so far and the throughput."""
+        elapsed = 0.0
+        if self._t_start is not None and self._t_last is not None:
+            elapsed = self._t_last - self._t_start
+        rate = 1 / elapsed if elapsed > 0 else 0.0
+        return dict(n_files=self.n_files, n_errors=self.n_errors, nbytes=self.nbytes,
+                    elapsed=elapsed, files_per_sec=self.n_files * rate,
+                    mb_per_sec=self.nbytes * rate / 2 ** 20)
+
+
+def _unknown_reader(fpath: Path) -> Any:
+    raise ValueError(f'No reader registered for the suffix of {fpath}')
+
+
+def read_many(paths: Union[PathLike, Iterable[PathLike]], ordered: bool = False,
+              max_workers: int = 8, processes: bool = False, max_in_flight: Optional[int] = None,
+              readers: Optional[Mapping[str, Callable[[Path], Any]]] = None) -> BulkReader:
+    """Reads many files in parallel, dispatching on the file suffix.
+
+    .pickle/.pkl files are read with read_pickle, .yaml/.yml with read_yaml and .h5/.hdf5 with
+    read_hdf5. A trailing compression suffix (e.g. .yaml.gz) is ignored when dispatching. Errors
+    are captured per file instead of aborting the whole read.
+
+    Parameters
+    ----------
+    paths : Union[PathLike, Iterable[PathLike]]
+        the files to read, or a glob pattern (recursive '**' is supported).
+    ordered : bool
+        If True, results are yielded in input order, otherwise in completion order.
+    max_workers : int
+        the number of worker threads (or processes).
+    processes : bool
+        If True, uses a process pool. Results are sent back to this process by pickling, so this
+        only pays off for formats that are expensive to parse (e.g. YAML or compressed files).
+    max_in_flight : Optional[int]
+        the maximum number of files read but not yet consumed, which bounds the memory held by
+        results. Defaults to 2 * max_workers.
+    readers : Optional[Mapping[str, Callable[[Path], Any]]]
+        additional or overriding readers keyed by suffix (e.g. {'.npy': np.load}). They must be
+        picklable when processes is True.
+
+    Returns
+    -------
+    reader : BulkReader
+        an iterator of ReadResult, with a stats() method reporting the throughput.
+    """
+    if isinstance(paths, (str, Path)):
+        path_list = [Path(p) for p in sorted(glob.glob(str(paths), recursive=True))]
+    else:
+        path_list = [Path(p) for p in paths]
+
+    all_readers = dict(_READERS)
+    if readers:
+        all_readers.update(readers)
+    if max_in_flight is None:
+        max_in_flight = 2 * max_workers
+
+    return BulkReader(path_list, all_readers, ordered, max_workers, processes,
+                      max(max_in_flight, 1))
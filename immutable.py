@@ -7,7 +7,14 @@ from __future__ import annotations
 from typing import TypeVar, Any, Generic, Dict, Iterable, Tuple, Union, Optional, overload
 
 import sys
+import heapq
 import bisect
+import weakref
+import operator
+import functools
+import hashlib
+import math
+from array import array
 from collections import Hashable, Mapping, Sequence
 
 T = TypeVar('T')
@@ -35,23 +42,44 @@ def combine_hash(a: int, b: int) -> int:
 
 
 class ImmutableList(Hashable, Sequence, Generic[T]):
-    """An immutable homogeneous list."""
+    """An immutable homogeneous list.
+
+    Slicing returns a view that shares the storage of the parent list, and the hash is only
+    computed the first time it is needed. The storage may be any sequence, to_immutable uses a
+    typed array for lists of floats or ints and a tuple otherwise.
+    """
+
+    __slots__ = ('_content', '_start', '_len', '_step', '_hash', '__weakref__')
 
     def __init__(self, values: Optional[Sequence[T]] = None) -> None:
         if values is None:
-            self._content = []
+            self._init_view([], 0, 0, 1)
             self._hash = 0
         elif isinstance(values, ImmutableList):
-            self._content = values._content
+            self._init_view(values._content, values._start, values._len, values._step)
             self._hash = values._hash
         else:
-            self._content = values
-            self._hash = 0
-            for v in values:
-                self._hash = combine_hash(self._hash, hash(v))
+            self._init_view(values, 0, len(values), 1)
+
+    def _init_view(self, content: Sequence[T], start: int, length: int, step: int) -> None:
+        self._content = content
+        self._start = start
+        self._len = length
+        self._step = step
+        self._hash: Optional[int] = None
+
+    def _is_full(self) -> bool:
+        return self._start == 0 and self._step == 1 and self._len == len(self._content)
 
     @classmethod
     def sequence_equal(cls, a: Sequence[T], b: Sequence[T]) -> bool:
+        if isinstance(a, ImmutableList) and isinstance(b, ImmutableList):
+            if a._content is b._content and a._start == b._start and a._step == b._step:
+                # views of the same storage
+                return a._len == b._len
+            if (isinstance(a._content, array) and isinstance(b._content, array) and
+                    a._is_full() and b._is_full()):
+                return a._content == b._content
         if len(a) != len(b):
             return False
         for av, bv in zip(a, b):
@@ -60,23 +88,44 @@ class ImmutableList(Hashable, Sequence, Generic[T]):
         return True
 
     def __repr__(self) -> str:
-        return repr(self._content)
+        return repr(list(self))
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # never pickle the parent storage of a view, nor the (process dependent) hash.
+        return self.__class__, (self._content if self._is_full() else list(self),)
+
+    def __setstate__(self, state: Any) -> None:
+        # pickles created before views were introduced.
+        if isinstance(state, tuple):
+            # (__dict__, slots) pair
+            state = state[0] or state[1]
+        self._init_view(state['_content'], 0, len(state['_content']), 1)
 
     def __eq__(self, other: Any) -> bool:
-        return (isinstance(other, ImmutableList) and self._hash == other._hash and
-                self.sequence_equal(self._content, other._content))
+        if self is other:
+            return True
+        return (isinstance(other, ImmutableList) and hash(self) == hash(other) and
+                self.sequence_equal(self, other))
 
     def __hash__(self) -> int:
+        if self._hash is None:
+            ans = 0
+            for v in self:
+                ans = combine_hash(ans, hash(v))
+            self._hash = ans
         return self._hash
 
     def __bool__(self) -> bool:
         return len(self) > 0
 
     def __len__(self) -> int:
-        return len(self._content)
+        return self._len
 
     def __iter__(self) -> Iterable[T]:
-        return iter(self._content)
+        if self._is_full():
+            return iter(self._content)
+        return map(self._content.__getitem__,
+                   range(self._start, self._start + self._len * self._step, self._step))
 
     @overload
     def __getitem__(self, idx: int) -> T: ...
@@ -85,16 +134,96 @@ class ImmutableList(Hashable, Sequence, Generic[T]):
     def __getitem__(self, idx: slice) -> ImmutableList[T]: ...
 
     def __getitem__(self, idx) -> T:
-        if isinstance(idx, int):
-            return self._content[idx]
-        return ImmutableList(self._content[idx])
+        if not isinstance(idx, slice):
+            idx = operator.index(idx)
+            if idx < 0:
+                idx += self._len
+            if not 0 <= idx < self._len:
+                raise IndexError('ImmutableList index out of range')
+            return self._content[self._start + idx * self._step]
+
+        start, stop, step = idx.indices(self._len)
+        ans = ImmutableList.__new__(ImmutableList)
+        ans._init_view(self._content, self._start + start * self._step,
+                       len(range(start, stop, step)), self._step * step)
+        return ans
 
     def __contains__(self, val: Any) -> bool:
-        return val in self._content
+        if self._is_full():
+            return val in self._content
+        return val in iter(self)
+
+
+def _pair_hash(key: Any, val: Any) -> int:
+    return hash((key, val))
+
+
+class _SortedKeys(ImmutableList):
+    """The sorted key vector of ImmutableSortedDict.
+
+    It also holds a key -> position hash index, built on the first lookup and shared by every
+    dictionary with this key set.
+    """
+
+    __slots__ = ('_index',)
+
+    def __init__(self, keys: Tuple[Any, ...]) -> None:
+        ImmutableList.__init__(self, keys)
+        self._index: Optional[Dict[Any, int]] = None
+
+    def index_of(self, key: Any, use_hash_index: bool = True) -> int:
+        """Returns the position of the given key, or -1 if it does not exist."""
+        if use_hash_index:
+            index = self._index
+            if index is None:
+                index = self._index = {k: i for i, k in enumerate(self._content)}
+            try:
+                return index.get(key, -1)
+            except TypeError:
+                # unhashable keys are never found.
+                return -1
+
+        keys = self._content
+        idx = bisect.bisect_left(keys, key)
+        return idx if idx != len(keys) and keys[idx] == key else -1
+
+
+# dictionaries with the same key set share one key vector. Equal keys of different types (1, 1.0
+# and True) must not share it, so the table is keyed by the key types too, and only keys whose
+# type says everything about them (not containers, whose items could differ in type) are shared.
+_key_table: weakref.WeakValueDictionary[Tuple[Tuple[Any, ...], Tuple[type, ...]], _SortedKeys] = \
+    weakref.WeakValueDictionary()
+_SHARED_KEY_TYPES = frozenset([str, int, float, bool, bytes])
+
+
+def _shared_keys(keys: Tuple[Any, ...]) -> _SortedKeys:
+    types = tuple(map(type, keys))
+    if not _SHARED_KEY_TYPES.issuperset(types):
+        return _SortedKeys(keys)
+    table_key = (keys, types)
+    ans = _key_table.get(table_key)
+    if ans is None:
+        ans = _SortedKeys(keys)
+        _key_table[table_key] = ans
+    return ans
 
 
 class ImmutableSortedDict(Hashable, Mapping, Generic[T, U]):
-    """An immutable dictionary with sorted keys."""
+    """An immutable dictionary with sorted keys.
+
+    The keys and values are stored in two sorted vectors, and the key vector is shared by all
+    dictionaries with the same key set. set(), update() and remove() return new instances that
+    share the key vector (when the key set is unchanged) and all the unchanged values with this
+    one. The hash is order independent (a sum of the item hashes), so derived instances update it
+    incrementally instead of recomputing it.
+
+    Lookups go through a hash index of the shared key vector. Set use_hash_index to False to bisect
+    the sorted keys instead (e.g. for keys with expensive hashes).
+    """
+
+    __slots__ = ('_keys', '_vals', '_hash', '__weakref__')
+
+    use_hash_index = True
 
     def __init__(self,
                  table: Optional[Mapping[T, Any]] = None) -> None:
@@ -104,24 +233,53 @@ class ImmutableSortedDict(Hashable, Mapping, Generic[T, U]):
                 self._vals = table._vals
                 self._hash = table._hash
             else:
-                self._keys = ImmutableList(sorted(table.keys()))
-                self._vals = ImmutableList([to_immutable(table[k]) for k in self._keys])
-                self._hash = combine_hash(hash(self._keys), hash(self._vals))
+                keys = tuple(sorted(table.keys()))
+                self._keys = _shared_keys(keys)
+                self._vals = tuple(to_immutable(table[k]) for k in keys)
+                self._hash: Optional[int] = None
         else:
-            self._keys = ImmutableList([])
-            self._vals = ImmutableList([])
-            self._hash = combine_hash(hash(self._keys), hash(self._vals))
+            self._keys = _shared_keys(())
+            self._vals = ()
+            self._hash = 0
+
+    @classmethod
+    def _from_sorted(cls, keys: _SortedKeys, vals: Tuple[U, ...],
+                     hash_val: Optional[int]) -> ImmutableSortedDict[T, U]:
+        ans = cls.__new__(cls)
+        ans._keys = keys
+        ans._vals = vals
+        ans._hash = hash_val
+        return ans
 
     def __repr__(self) -> str:
         return repr(list(zip(self._keys, self._vals)))
 
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return self.__class__, (self.to_dict(),)
+
+    def __setstate__(self, state: Any) -> None:
+        # pickles created before the hash became order independent.
+        if isinstance(state, tuple):
+            # (__dict__, slots) pair
+            state = state[0] or state[1]
+        self._keys = _shared_keys(tuple(state['_keys']))
+        self._vals = tuple(state['_vals'])
+        self._hash = None
+
     def __eq__(self, other: Any) -> bool:
+        if self is other:
+            return True
         return (isinstance(other, ImmutableSortedDict) and
-                self._hash == other._hash and
+                hash(self) == hash(other) and
                 self._keys == other._keys and
                 self._vals == other._vals)
 
     def __hash__(self) -> int:
+        if self._hash is None:
+            ans = 0
+            for k, v in zip(self._keys, self._vals):
+                ans += _pair_hash(k, v)
+            self._hash = ans & sys.maxsize
         return self._hash
 
     def __bool__(self) -> bool:
@@ -134,18 +292,17 @@ class ImmutableSortedDict(Hashable, Mapping, Generic[T, U]):
         return iter(self._keys)
 
     def __contains__(self, item: Any) -> bool:
-        idx = bisect.bisect_left(self._keys, item)
-        return idx != len(self._keys) and self._keys[idx] == item
+        return self._keys.index_of(item, self.use_hash_index) >= 0
 
     def __getitem__(self, item: T) -> U:
-        idx = bisect.bisect_left(self._keys, item)
-        if idx == len(self._keys) or self._keys[idx] != item:
+        idx = self._keys.index_of(item, self.use_hash_index)
+        if idx < 0:
             raise KeyError('Key not found: {}'.format(item))
         return self._vals[idx]
 
     def get(self, item: T, default: Optional[U] = None) -> Optional[U]:
-        idx = bisect.bisect_left(self._keys, item)
-        if idx == len(self._keys) or self._keys[idx] != item:
+        idx = self._keys.index_of(item, self.use_hash_index)
+        if idx < 0:
             return default
         return self._vals[idx]
 
@@ -158,13 +315,104 @@ class ImmutableSortedDict(Hashable, Mapping, Generic[T, U]):
     def items(self) -> Iterable[Tuple[T, U]]:
         return zip(self._keys, self._vals)
 
+    def _update_hash(self, removed: Iterable[Tuple[T, U]],
+                     added: Iterable[Tuple[T, U]]) -> Optional[int]:
+        if self._hash is None:
+            return None
+        ans = self._hash
+        for k, v in removed:
+            ans -= _pair_hash(k, v)
+        for k, v in added:
+            ans += _pair_hash(k, v)
+        return ans & sys.maxsize
+
+    def set(self, key: T, value: Any) -> ImmutableSortedDict[T, U]:
+        """Returns a new dictionary with the given key set to value.
+
+        Parameters
+        ----------
+        key : T
+            the key.
+        value : Any
+            the value, converted with to_immutable.
+
+        Returns
+        -------
+        ans : ImmutableSortedDict[T, U]
+            the new dictionary, sharing the unchanged structure with this one.
+        """
+        value = to_immutable(value)
+        keys = self._keys._content
+        vals = self._vals
+        idx = bisect.bisect_left(keys, key)
+        if idx != len(keys) and keys[idx] == key:
+            old = vals[idx]
+            if old is value:
+                return self
+            new_vals = vals[:idx] + (value,) + vals[idx + 1:]
+            new_hash = self._update_hash([(key, old)], [(key, value)])
+            return self._from_sorted(self._keys, new_vals, new_hash)
+
+        new_keys = _shared_keys(keys[:idx] + (key,) + keys[idx:])
+        new_vals = vals[:idx] + (value,) + vals[idx:]
+        return self._from_sorted(new_keys, new_vals, self._update_hash([], [(key, value)]))
+
+    def remove(self, key: T) -> ImmutableSortedDict[T, U]:
+        """Returns a new dictionary without the given key.
+
+        Raises KeyError if the key does not exist.
+        """
+        keys = self._keys._content
+        vals = self._vals
+        idx = bisect.bisect_left(keys, key)
+        if idx == len(keys) or keys[idx] != key:
+            raise KeyError('Key not found: {}'.format(key))
+        new_keys = _shared_keys(keys[:idx] + keys[idx + 1:])
+        new_vals = vals[:idx] + vals[idx + 1:]
+        return self._from_sorted(new_keys, new_vals,
+                                 self._update_hash([(key, vals[idx])], []))
+
+    def update(self, table: Optional[Mapping[T, Any]] = None,
+               **kwargs: Any) -> ImmutableSortedDict[T, U]:
+        """Returns a new dictionary with the items of table (and kwargs) added or replaced.
+
+        The key vector is shared with this dictionary if no new keys are added.
+        """
+        changes = {}
+        if table is not None:
+            changes.update(table)
+        changes.update(kwargs)
+        if not changes:
+            return self
+
+        keys = self._keys._content
+        vals = list(self._vals)
+        new_items = []
+        removed = []
+        added = []
+        for k, v in changes.items():
+            v = to_immutable(v)
+            idx = bisect.bisect_left(keys, k)
+            if idx != len(keys) and keys[idx] == k:
+                removed.append((k, vals[idx]))
+                vals[idx] = v
+            else:
+                new_items.append((k, v))
+            added.append((k, v))
+
+        new_hash = self._update_hash(removed, added)
+        if not new_items:
+            return self._from_sorted(self._keys, tuple(vals), new_hash)
+
+        new_items.sort(key=operator.itemgetter(0))
+        merged = list(heapq.merge(zip(keys, vals), new_items, key=operator.itemgetter(0)))
+        return self._from_sorted(_shared_keys(tuple(k for k, _ in merged)),
+                                 tuple(v for _, v in merged), new_hash)
+
     def copy(self, append: Optional[Dict[T, Any]] = None) -> ImmutableSortedDict[T, U]:
         if append is None:
-            return self.__class__()
-        else:
-            tmp = self.to_dict()
-            tmp.update(append)
-            return self.__class__(tmp)
+            return self.__class__(self)
+        return self.update(append)
 
     def to_dict(self) -> Dict[T, U]:
         return dict(zip(self._keys, self._vals))
@@ -173,24 +421,266 @@ class ImmutableSortedDict(Hashable, Mapping, Generic[T, U]):
 Param = ImmutableSortedDict[str, Any]
 
 
-def to_immutable(obj: Any) -> ImmutableType:
-    """Convert the given Python object into an immutable type."""
+class FrozenArray(Hashable):
+    """A hashable, read-only numpy array.
+
+    The array is not copied: its writeable flag is turned off instead, so it must not be modified
+    through other views of the same memory afterwards. The hash is a digest of the dtype, shape and
+    raw buffer, computed in chunks on first use. Two FrozenArrays are equal if they have the same
+    dtype, shape and hash, and np.array_equal holds, with NaNs equal to each other.
+
+    Parameters
+    ----------
+    arr : np.ndarray
+        the array to freeze. Object arrays are not supported.
+    """
+
+    __slots__ = ('_arr', '_hash', '__weakref__')
+
+    _CHUNK_BYTES = 4 * 2 ** 20
+
+    def __init__(self, arr: Any) -> None:
+        if isinstance(arr, FrozenArray):
+            self._arr = arr._arr
+            self._hash = arr._hash
+            return
+        if arr.dtype.hasobject:
+            raise ValueError('Cannot freeze an array of Python objects, use a list instead')
+        arr.flags.writeable = False
+        self._arr = arr
+        self._hash: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return f'{self.__class__.__name__}({self._arr!r})'
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return self.__class__, (self._arr,)
+
+    def __eq__(self, other: Any) -> bool:
+        if self is other:
+            return True
+        if not (isinstance(other, FrozenArray) and self._arr.dtype == other._arr.dtype and
+                self._arr.shape == other._arr.shape and hash(self) == hash(other)):
+            return False
+        np = sys.modules['numpy']
+        if self._arr is other._arr:
+            return True
+        # NaNs have the same bytes, so the same digest, and must compare equal like them
+        equal_nan = self._arr.dtype.kind in 'fc'
+        return bool(np.array_equal(self._arr, other._arr, equal_nan=equal_nan))
+
+    def __hash__(self) -> int:
+        if self._hash is None:
+            self._hash = self._digest()
+        return self._hash
+
+    def __len__(self) -> int:
+        return len(self._arr)
+
+    def __iter__(self) -> Iterable[Any]:
+        return iter(self._arr)
+
+    def __getitem__(self, idx: Any) -> Any:
+        return self._arr[idx]
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> Any:
+        if dtype is None or dtype == self._arr.dtype:
+            return self._arr
+        return self._arr.astype(dtype)
+
+    @property
+    def array(self) -> Any:
+        """the read-only numpy array."""
+        return self._arr
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._arr.shape
+
+    @property
+    def dtype(self) -> Any:
+        return self._arr.dtype
+
+    def _digest(self) -> int:
+        arr = self._arr
+        digest = hashlib.blake2b(digest_size=8)
+        digest.update(f'{arr.dtype.str}{arr.shape}'.encode())
+        for block in self.iter_bytes():
+            digest.update(block)
+        return int.from_bytes(digest.digest(), 'little') & sys.maxsize
+
+    def iter_bytes(self) -> Iterable[Any]:
+        """Yields the data of the array in C order, as blocks of bytes of at most about 4 MiB.
+
+        -0.0 is replaced by 0.0, since they compare equal, so equal arrays yield the same bytes.
+        """
+        np = sys.modules['numpy']
+        arr = self._arr
+        normalize = arr.dtype.kind in 'fc'
+        if arr.flags.c_contiguous:
+            flat = arr.reshape(-1)
+            step = max(self._CHUNK_BYTES // max(arr.itemsize, 1), 1)
+            blocks = (flat[i:i + step] for i in range(0, flat.size, step))
+        else:
+            # hash row blocks to avoid copying the whole non-contiguous array at once.
+            step = max(self._CHUNK_BYTES // max(arr[:1].nbytes, 1), 1)
+            blocks = (arr[i:i + step] for i in range(0, len(arr), step))
+        for block in blocks:
+            if normalize:
+                block = block + 0
+            yield np.ascontiguousarray(block).reshape(-1).view(np.uint8)
+
+
+def _same_types(a: Any, b: Any) -> bool:
+    """Returns True if the equal objects a and b also hold values of the same types.
+
+    1, 1.0 and True are equal, but interning one for the other would change the user's values.
+    """
+    if a is b:
+        return True
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, ImmutableSortedDict):
+        return (all(map(_same_types, a._keys, b._keys)) and
+                all(map(_same_types, a._vals, b._vals)))
+    if isinstance(a, ImmutableList):
+        if isinstance(a._content, array) and isinstance(b._content, array):
+            return a._content.typecode == b._content.typecode
+        return all(map(_same_types, a, b))
+    if isinstance(a, tuple):
+        return all(map(_same_types, a, b))
+    # FrozenArrays of different dtypes are never equal
+    return True
+
+
+class InternTable:
+    """A bounded, weak-valued table of canonical immutable objects (hash-consing).
+
+    Interning maps every ImmutableList / ImmutableSortedDict to the first live instance that is
+    equal to it and holds values of the same types, so equal subtrees are shared in memory and
+    compare by identity. An object equal to a live entry of other types (e.g. [1.0] and [1]) is
+    returned without being interned. Entries disappear
+    once nothing else references them.
+
+    Parameters
+    ----------
+    max_size : int
+        the maximum number of entries. Once full, new objects are returned without being interned.
+    """
+
+    def __init__(self, max_size: int = 1000000) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._table: Dict[int, weakref.ref] = {}
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def info(self) -> Dict[str, Union[int, float]]:
+        """Returns the hit/miss counters, the hit rate and the current size of the table."""
+        total = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses,
+                    hit_rate=self.hits / total if total else 0.0,
+                    size=len(self._table), max_size=self.max_size)
+
+    def clear(self) -> None:
+        self._table.clear()
+
+    def intern(self, obj: T) -> T:
+        """Returns the canonical instance equal to obj, registering obj if there is none."""
+        key = hash(obj)
+        ref = self._table.get(key)
+        if ref is not None:
+            canon = ref()
+            if canon is not None and canon == obj and _same_types(canon, obj):
+                self.hits += 1
+                return canon
+        self.misses += 1
+        # on a hash collision with a live object the new object is simply not interned.
+        if (ref is None or ref() is None) and len(self._table) < self.max_size:
+            self._table[key] = weakref.ref(obj, functools.partial(self._remove, key))
+        return obj
+
+    def _remove(self, key: int, ref: weakref.ref) -> None:
+        if self._table.get(key) is ref:
+            del self._table[key]
+
+
+intern_table = InternTable()
+
+
+def to_immutable(obj: Any, intern: bool = False) -> ImmutableType:
+    """Convert the given Python object into an immutable type.
+
+    Parameters
+    ----------
+    obj : Any
+        the object to convert.
+    intern : bool
+        If True, every converted list and dictionary is interned in intern_table, so equal
+        subtrees become the same object.
+
+    Returns
+    -------
+    ans : ImmutableType
+        the immutable object.
+    """
+    return _to_immutable(obj, intern_table if intern else None)
+
+
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _pack_numbers(values: list) -> Optional[array]:
+    """Returns a typed array with the values of a list of only floats or only ints, else None."""
+    if not values:
+        return None
+    types = set(map(type, values))
+    if len(types) != 1:
+        return None
+    if float in types:
+        # NaNs hash by identity, which a typed array does not preserve.
+        if not any(map(math.isnan, values)):
+            return array('d', values)
+    elif int in types:
+        if _INT64_MIN <= min(values) and max(values) <= _INT64_MAX:
+            return array('q', values)
+    return None
+
+
+def _to_immutable(obj: Any, table: Optional[InternTable]) -> ImmutableType:
     if obj is None:
         return obj
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(obj, np.ndarray):
+        ans = FrozenArray(obj)
+        return ans if table is None else table.intern(ans)
     if isinstance(obj, Hashable):
         # gets around cases of tuple of un-hashable types.
         try:
             hash(obj)
-            return obj
         except TypeError:
             pass
+        else:
+            if table is not None and isinstance(obj, (ImmutableList, ImmutableSortedDict,
+                                                      FrozenArray)):
+                return table.intern(obj)
+            return obj
     if isinstance(obj, tuple):
-        return tuple((to_immutable(v) for v in obj))
+        return tuple((_to_immutable(v, table) for v in obj))
     if isinstance(obj, list):
-        return ImmutableList([to_immutable(v) for v in obj])
-    if isinstance(obj, set):
-        return ImmutableList([to_immutable(v) for v in sorted(obj)])
-    if isinstance(obj, dict):
-        return ImmutableSortedDict(obj)
-
-    raise ValueError('Cannot convert the following object to immutable type: {}'.format(obj))
+        ans = ImmutableList(_pack_numbers(obj) or tuple(_to_immutable(v, table) for v in obj))
+    elif isinstance(obj, set):
+        ans = ImmutableList(tuple(_to_immutable(v, table) for v in sorted(obj)))
+    elif isinstance(obj, dict):
+        if table is None:
+            return ImmutableSortedDict(obj)
+        keys = tuple(sorted(obj.keys()))
+        ans = ImmutableSortedDict._from_sorted(
+            _shared_keys(keys), tuple(_to_immutable(obj[k], table) for k in keys), None)
+    else:
+        raise ValueError('Cannot convert the following object to immutable type: {}'.format(obj))
+
+    return ans if table is None else table.intern(ans)
@@ -1,25 +1,47 @@
-from typing import Union, Mapping, Any, Dict, List, Tuple
+from typing import Union, Mapping, Any, Dict, List, Tuple, Optional
 
 
+import os
+import pickle
 from pathlib import Path
 import pandas as pd
 from utils.immutable import ImmutableSortedDict, ImmutableList
-from utils.file import read_yaml, write_yaml
+from utils.file import read_yaml, pack_record, read_records
+
 
 class LoggerBase:
+    """Keeps a table of experiment records and a cache from identifiers to record indices.
+
+    Records are stored as append-only CSV part files in <root>/<name>_parts, one part per
+    save_records() call, and the cache as an append-only stream of length and CRC prefixed
+    pickles in <root>/cache.pickle. Saving therefore costs O(new records). A batch torn by a crash
+    is ignored when reading and cut off by the next save. The Excel workbook
+    (<root>/<name>.xlsx by default) is only written on demand by export_excel(). An existing
+    workbook and cache.yaml from older versions are migrated once, the first time the logger is
+    created on them.
+    """
 
     def __init__(self, root_dir: Union[str, Path], fname: str = ''):
 
         self._root_path = Path(root_dir)
 
         self.fname = self._root_path / (fname or 'experiments')
-        self._cache_fname = self._root_path / 'cache.yaml'
+        self._cache_fname = self._root_path / 'cache.pickle'
 
         if not self.fname.suffix:
             self.fname = self.fname.with_suffix('.xlsx')
+        self._parts_dir = self._root_path / f'{self.fname.stem}_parts'
+        self._n_parts: Optional[int] = None
 
         self._new_entries: List[Tuple[Mapping[str, Any], Mapping[str, Any]]] = []
 
+        # the cache stream is only read from where the last read stopped
+        self._cache: Dict[ImmutableSortedDict, str] = {}
+        self._cache_offset = 0
+        self._cache_inode: Optional[int] = None
+
+        self._migrate()
+
     def __contains__(self, item):
         if self._contains_none(item):
             raise ValueError('Entry cannot contain None value, because of hashing issues.')
@@ -41,34 +63,94 @@ class LoggerBase:
 
 
     def save_records(self):
-        # read
-        df = self._read_excel()
-        cache = self._read_cache()
-
-        # update the records
+        if not self._new_entries:
+            return
         for entry, ident in self._new_entries:
             if self._contains_none(ident):
                 raise ValueError('Entry cannot contain None value, because of hashing issues.')
-            cache.update({ident: entry['idx']})
-            df = df.append(entry, ignore_index=True)
+            try:
+                hash(ident)
+            except TypeError:
+                # nothing is written, a single unhashable key would break every later lookup
+                raise TypeError(f'Identifier of {entry["idx"]} is not hashable, convert it with '
+                                f'to_immutable first: {ident}') from None
 
-        # write back
-        df.to_excel(self.fname, na_rep='NaN', float_format='%.6f')
-        write_yaml(self._cache_fname, cache)
+        # the records are written first, so the cache never points to a missing record
+        self._write_part(pd.DataFrame([entry for entry, _ in self._new_entries]))
+        self._append_cache([(ident, entry['idx']) for entry, ident in self._new_entries])
 
         # clear memory
         self._new_entries.clear()
 
-
-    def _read_excel(self) -> pd.DataFrame:
-        if self.fname.exists():
-            return pd.read_excel(self.fname, index_col=0)
-        return pd.DataFrame()
+    def read_records(self) -> pd.DataFrame:
+        """Returns all the saved records, in the order they were saved."""
+        parts = sorted(self._parts_dir.glob('part-*.csv')) if self._parts_dir.exists() else []
+        if not parts:
+            return pd.DataFrame()
+        return pd.concat([pd.read_csv(part) for part in parts], ignore_index=True, sort=False)
+
+    def export_excel(self, fname: Union[str, Path, None] = None) -> Path:
+        """Writes all the saved records to an Excel workbook, self.fname by default."""
+        fname = Path(fname) if fname else self.fname
+        self.read_records().to_excel(fname, na_rep='NaN', float_format='%.6f')
+        return fname
+
+    def _write_part(self, df: pd.DataFrame):
+        self._parts_dir.mkdir(parents=True, exist_ok=True)
+        if self._n_parts is None:
+            self._n_parts = len(list(self._parts_dir.glob('part-*.csv')))
+        part = self._parts_dir / f'part-{self._n_parts:06d}.csv'
+        while part.exists():
+            # another logger on the same directory saved in the meantime
+            self._n_parts += 1
+            part = self._parts_dir / f'part-{self._n_parts:06d}.csv'
+        self._n_parts += 1
+        tmp = part.with_suffix('.tmp')
+        df.to_csv(tmp, index=False)
+        # a crash never leaves a half written part behind
+        os.replace(tmp, part)
+
+    def _append_cache(self, items: List[Tuple[Mapping[str, Any], str]]):
+        self._root_path.mkdir(parents=True, exist_ok=True)
+        # read up to the last complete batch, anything after it is a torn batch to cut off
+        self._read_cache()
+        payload = pickle.dumps(items, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self._cache_fname, 'ab') as f:
+            if f.tell() != self._cache_offset:
+                f.truncate(self._cache_offset)
+                f.seek(self._cache_offset)
+            f.write(pack_record(payload))
+            end = f.tell()
+        self._cache.update(items)
+        self._cache_offset = end
+        self._cache_inode = os.stat(self._cache_fname).st_ino
 
     def _read_cache(self) -> Dict[ImmutableSortedDict, str]:
-        if self._cache_fname.exists():
-            return read_yaml(self._cache_fname)
-        return {}
+        # the cache is checked on every membership test, only read what was appended since
+        try:
+            stat = self._cache_fname.stat()
+        except FileNotFoundError:
+            self._cache, self._cache_offset, self._cache_inode = {}, 0, None
+            return self._cache
+        if stat.st_ino != self._cache_inode or stat.st_size < self._cache_offset:
+            # the file was replaced, start over
+            self._cache, self._cache_offset, self._cache_inode = {}, 0, stat.st_ino
+        if stat.st_size > self._cache_offset:
+            with open(self._cache_fname, 'rb') as f:
+                f.seek(self._cache_offset)
+                # stops before a batch whose append is not complete yet, or torn by a crash
+                for offset, payload in read_records(f):
+                    self._cache.update(pickle.loads(payload))
+                    self._cache_offset = offset
+        return self._cache
+
+    def _migrate(self):
+        """Moves the records of an existing workbook and cache.yaml to the append-only files."""
+        if not self._parts_dir.exists() and self.fname.exists():
+            self._write_part(pd.read_excel(self.fname, index_col=0))
+        yaml_cache = self._root_path / 'cache.yaml'
+        if not self._cache_fname.exists() and yaml_cache.exists():
+            self._append_cache(list(read_yaml(yaml_cache).items()))
 
     def _contains_none(self, obj: object):
         if isinstance(obj, (dict, ImmutableSortedDict)):
@@ -85,5 +167,3 @@ class LoggerBase:
             return False
 
         return obj is None
-
-
@@ -0,0 +1,50 @@
+"""Compares the cost of fancy-index gathered batches with contiguous slice views in
+utils.data.batch.BatchGenerator.
+
+Each mode iterates over --epochs epochs of shuffled batches, after a warm-up epoch, and touches
+every batch (a sum), so the time includes both building the batches and reading them.
+
+usage: python -m utils.scripts.bench_batch_gather [--n N] [--dim D] [--bsize B] [--epochs E]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.data.batch import BatchGenerator
+
+
+def bench(x, y, bsize: int, epochs: int, contiguous: bool) -> float:
+    gen = BatchGenerator(x, y, bsize, shuffle_epochs=True, drop_last=False, contiguous=contiguous)
+    # the first epoch allocates (and page faults) the reusable buffers, leave it out
+    for _ in gen.get_gen(gen.n_batches_per_epoch):
+        pass
+    n_batches = gen.n_batches_per_epoch * epochs
+    t0 = time.perf_counter()
+    for xb, yb in gen.get_gen(n_batches):
+        xb.sum()
+    return (time.perf_counter() - t0) / n_batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--bsize', type=int, nargs='+', default=[32, 256, 2048])
+    parser.add_argument('--epochs', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((args.n, args.dim), dtype=np.float32)
+    y = rng.integers(0, 10, args.n)
+
+    for bsize in args.bsize:
+        gather = bench(x, y, bsize, args.epochs, contiguous=False)
+        view = bench(x, y, bsize, args.epochs, contiguous=True)
+        print(f'bsize={bsize:<6d} gather={gather * 1e6:9.1f} us/batch  '
+              f'view={view * 1e6:9.1f} us/batch (incl. one gather per epoch)  '
+              f'speedup={gather / view:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Benchmarks utils.data.batch.BatchGenerator with and without prefetching workers.
+
+The consumer simulates a training step of --step-ms milliseconds per batch, so the benefit of
+prefetching shows as the batch rate getting closer to 1000 / step-ms.
+
+usage: python -m utils.scripts.bench_batch_prefetch [--workers W [W ...]] [--bsize B]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.data.batch import BatchGenerator
+
+
+def bench(x, y, bsize: int, n_batches: int, step_ms: float, **kwargs) -> float:
+    gen = BatchGenerator(x, y, bsize, **kwargs).get_gen(n_batches)
+    t0 = time.perf_counter()
+    for _ in gen:
+        if step_ms:
+            time.sleep(step_ms / 1000)
+    return n_batches / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4, 8])
+    parser.add_argument('--n', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--bsize', type=int, default=256)
+    parser.add_argument('--n-batches', type=int, default=500)
+    parser.add_argument('--prefetch', type=int, default=4)
+    parser.add_argument('--step-ms', type=float, default=2.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((args.n, args.dim), dtype=np.float32)
+    y = rng.integers(0, 10, args.n)
+
+    for n_workers in args.workers:
+        threads = bench(x, y, args.bsize, args.n_batches, args.step_ms,
+                        num_workers=n_workers, prefetch=args.prefetch)
+        line = f'workers={n_workers:<3d} threads={threads:8.1f} batches/s'
+        if n_workers:
+            procs = bench(x, y, args.bsize, args.n_batches, args.step_ms,
+                          num_workers=n_workers, prefetch=args.prefetch, use_processes=True)
+            line += f'  processes={procs:8.1f} batches/s'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Benchmarks utils.data.batch.BlockShuffleBatchGenerator over a memory-mapped .npy file.
+
+A file of --mb MiB is written, then one epoch is read with fully random batches (BatchGenerator
+over the memmap) and with block-shuffled batches for several window sizes. For each, the script
+reports the read throughput and two shuffle quality measures:
+
+- rho: the correlation between the position of a row in the epoch and its position in the file
+  (0 for a perfect shuffle, 1 for sequential reads),
+- blocks/batch: the average number of distinct blocks a batch draws from, relative to a perfect
+  shuffle (1.0 is as diverse as a perfect shuffle).
+
+The file was just written, so it is likely in the page cache. Use a file larger than RAM, or drop
+the page cache before running, for cold reads.
+
+usage: python -m utils.scripts.bench_block_shuffle [--mb M] [--windows W [W ...]] [--dir DIR]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from utils.data.batch import BatchGenerator, BlockShuffleBatchGenerator
+
+
+def quality(ids: np.ndarray, bsize: int, block_size: int, n: int):
+    rho = abs(np.corrcoef(np.arange(len(ids)), ids)[0, 1])
+    blocks = ids[:len(ids) // bsize * bsize].reshape(-1, bsize) // block_size
+    distinct = np.mean([len(np.unique(b)) for b in blocks])
+    # expected distinct blocks in a batch drawn uniformly from all rows
+    n_blocks = -(-n // block_size)
+    expected = n_blocks * (1 - (1 - 1 / n_blocks) ** bsize)
+    return rho, distinct / expected
+
+
+def run(gen, n_batches: int, row_bytes: int, bsize: int, block_size: int, n: int, name: str):
+    ids = []
+    t0 = time.perf_counter()
+    for x, y in gen.get_gen(n_batches):
+        ids.append(y)
+    elapsed = time.perf_counter() - t0
+    rho, diversity = quality(np.concatenate(ids), bsize, block_size, n)
+    mb = n_batches * bsize * row_bytes / 2 ** 20
+    print(f'{name:<24s} {mb / elapsed:9.1f} MB/s  rho={rho:.4f}  blocks/batch={diversity:.3f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--mb', type=int, default=1024)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--bsize', type=int, default=256)
+    parser.add_argument('--block-size', type=int, default=None)
+    parser.add_argument('--windows', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--num-workers', type=int, default=1)
+    parser.add_argument('--dir', default=None, help='where to write the data file')
+    args = parser.parse_args()
+
+    row_bytes = args.dim * 4
+    n = args.mb * 2 ** 20 // row_bytes
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        x_path, y_path = os.path.join(root, 'x.npy'), os.path.join(root, 'y.npy')
+        x = np.lib.format.open_memmap(x_path, mode='w+', dtype=np.float32, shape=(n, args.dim))
+        for start in range(0, n, 65536):
+            x[start:start+65536] = np.random.standard_normal((min(65536, n - start), args.dim))
+        x.flush()
+        del x
+        np.save(y_path, np.arange(n))
+
+        gen = BlockShuffleBatchGenerator(x_path, y_path, args.bsize, block_size=args.block_size)
+        block_size = gen.block_size
+        n_batches = gen.n_batches_per_epoch
+        print(f'{n} rows of {row_bytes} bytes, block size {block_size} rows, '
+              f'{n_batches} batches of {args.bsize}')
+
+        memmaps = np.load(x_path, mmap_mode='r'), np.load(y_path, mmap_mode='r')
+        run(BatchGenerator(*memmaps, args.bsize, shuffle_epochs=True), n_batches, row_bytes,
+            args.bsize, block_size, n, 'random (memmap)')
+        for window in args.windows:
+            gen = BlockShuffleBatchGenerator(x_path, y_path, args.bsize, block_size=block_size,
+                                             window_blocks=window, num_workers=args.num_workers)
+            run(gen, n_batches, row_bytes, args.bsize, block_size, n, f'block, window={window}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Compares random batching of variable-length sequences with utils.data.batch.BucketBatchGenerator.
+
+The current mode is BatchGenerator over an object array of sequences, padded with pad_sequences
+as collate_fn. Every batch goes through a simulated model step (embedding lookup and a matmul over
+all padded positions), so the step time grows with padding. The script reports the padding
+fraction and the real (non-padding) tokens per second.
+
+usage: python -m utils.scripts.bench_bucket_batching [--n N] [--bsize B] [--max-tokens T ...]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.data.batch import BatchGenerator, BucketBatchGenerator, pad_sequences
+
+
+def step(padded: np.ndarray, emb: np.ndarray, w: np.ndarray):
+    h = emb[padded]
+    return h.reshape(-1, h.shape[-1]) @ w
+
+
+def run(name: str, gen, n_tokens: int, emb: np.ndarray, w: np.ndarray):
+    """Runs steps until about n_tokens real tokens (one epoch) were processed."""
+    real = total = 0
+    t0 = time.perf_counter()
+    batches = gen.get_gen(n_tokens)
+    for padded, mask in batches:
+        step(padded, emb, w)
+        real += int(mask.sum())
+        total += mask.size
+        if real >= n_tokens:
+            break
+    batches.close()
+    elapsed = time.perf_counter() - t0
+    print(f'{name:<28s} padding={1 - real / total:6.1%}  {real / elapsed:12.0f} real tokens/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=20000)
+    parser.add_argument('--bsize', type=int, default=32)
+    parser.add_argument('--max-tokens', type=int, nargs='+', default=[4096])
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--vocab', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # long-tailed lengths, as in text
+    lengths = np.clip(rng.lognormal(4, 0.8, args.n).astype(int), 1, 1024)
+    seqs = [rng.integers(1, args.vocab, n) for n in lengths]
+    emb = rng.standard_normal((args.vocab, args.dim), dtype=np.float32)
+    w = rng.standard_normal((args.dim, args.dim), dtype=np.float32)
+
+    x = np.empty(len(seqs), dtype=object)
+    x[:] = seqs
+    n_tokens = int(lengths.sum())
+    current = BatchGenerator(x, bsize=args.bsize, shuffle_epochs=True,
+                             collate_fn=pad_sequences)
+    run(f'random, bsize={args.bsize}', current, n_tokens, emb, w)
+    run(f'bucketed, bsize={args.bsize}', BucketBatchGenerator(seqs, bsize=args.bsize), n_tokens,
+        emb, w)
+    for max_tokens in args.max_tokens:
+        run(f'bucketed, max_tokens={max_tokens}',
+            BucketBatchGenerator(seqs, max_tokens=max_tokens), n_tokens, emb, w)
+
+
+if __name__ == '__main__':
+    main()
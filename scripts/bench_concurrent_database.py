@@ -0,0 +1,94 @@
+"""Benchmarks the add throughput of utils.data.concurrent.ConcurrentDatabase against the number of
+workers.
+
+Each worker adds --n-adds objects. Threads add directly to the shared database, processes send
+batches through the queue of ConcurrentDatabase.start_server(). The serial Database with a single
+caller is the baseline.
+
+usage: python -m utils.scripts.bench_concurrent_database [--workers W [W ...]] [--n-adds N]
+"""
+import argparse
+import threading
+import time
+import multiprocessing as mp
+
+from utils.data.database import Database
+from utils.data.concurrent import ConcurrentDatabase, BatchSubmitter
+
+
+def designs(worker: int, n_adds: int, n_unique: int):
+    return [((worker * n_adds + i) % n_unique, i % 7) for i in range(n_adds)]
+
+
+def bench_serial(n_workers: int, n_adds: int, n_unique: int) -> float:
+    db = Database()
+    batches = [designs(w, n_adds, n_unique) for w in range(n_workers)]
+    t0 = time.perf_counter()
+    for batch in batches:
+        for dsn in batch:
+            db.add(dsn)
+    return time.perf_counter() - t0
+
+
+def bench_threads(n_workers: int, n_adds: int, n_unique: int, n_shards: int) -> float:
+    db = ConcurrentDatabase(n_shards)
+    batches = [designs(w, n_adds, n_unique) for w in range(n_workers)]
+
+    def run(batch):
+        for dsn in batch:
+            db.add(dsn)
+
+    threads = [threading.Thread(target=run, args=(batch,)) for batch in batches]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    assert len(db) == n_workers * n_adds
+    return elapsed
+
+
+def _process_worker(queue, worker: int, n_adds: int, n_unique: int, batch_size: int):
+    with BatchSubmitter(queue, batch_size) as submitter:
+        submitter.extend(designs(worker, n_adds, n_unique))
+
+
+def bench_processes(n_workers: int, n_adds: int, n_unique: int, n_shards: int,
+                    batch_size: int) -> float:
+    db = ConcurrentDatabase(n_shards)
+    queue = db.start_server()
+    procs = [mp.Process(target=_process_worker, args=(queue, w, n_adds, n_unique, batch_size))
+             for w in range(n_workers)]
+    t0 = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    db.stop_server()
+    elapsed = time.perf_counter() - t0
+    assert len(db) == n_workers * n_adds
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--n-adds', type=int, default=100000)
+    parser.add_argument('--n-unique', type=int, default=50000)
+    parser.add_argument('--n-shards', type=int, default=16)
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    for n_workers in args.workers:
+        total = n_workers * args.n_adds
+        serial = bench_serial(n_workers, args.n_adds, args.n_unique)
+        threads = bench_threads(n_workers, args.n_adds, args.n_unique, args.n_shards)
+        procs = bench_processes(n_workers, args.n_adds, args.n_unique, args.n_shards,
+                                args.batch_size)
+        print(f'workers={n_workers:<3d} serial={total / serial:10.0f} adds/s  '
+              f'threads={total / threads:10.0f} adds/s  processes={total / procs:10.0f} adds/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Benchmarks checkpointing and recovery of utils.data.durable.DurableDatabase.
+
+For every size, the database is filled, snapshotted, and a tail of extra adds is logged. The
+script reports the add, checkpoint and snapshot times and the time to recover the database from
+the snapshot plus the log tail.
+
+usage: python -m utils.scripts.bench_database_recovery [--sizes N [N ...]] [--tail-frac F]
+"""
+import argparse
+import tempfile
+import time
+
+from utils.data.durable import DurableDatabase
+
+
+def bench(size: int, tail_frac: float, n_unique: int):
+    n_tail = int(size * tail_frac)
+    with tempfile.TemporaryDirectory() as root:
+        db = DurableDatabase(root, fsync=False)
+        t0 = time.perf_counter()
+        for i in range(size - n_tail):
+            db.add((i % n_unique, i % 7))
+        t1 = time.perf_counter()
+        db.snapshot()
+        t2 = time.perf_counter()
+        for i in range(n_tail):
+            db.add((i % n_unique, 7))
+        t3 = time.perf_counter()
+        db.checkpoint()
+        t4 = time.perf_counter()
+        db.close()
+
+        t5 = time.perf_counter()
+        recovered = DurableDatabase(root, fsync=False)
+        t6 = time.perf_counter()
+        assert len(recovered) == size and recovered.n_log_records == n_tail
+        recovered.close()
+
+    print(f'size={size:<10d} add={(t1 - t0 + t3 - t2) / size * 1e6:6.2f} us/entry  '
+          f'snapshot={t2 - t1:7.2f}s  checkpoint({n_tail} new)={t4 - t3:6.3f}s  '
+          f'recovery={t6 - t5:7.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 10000000])
+    parser.add_argument('--tail-frac', type=float, default=0.1)
+    parser.add_argument('--n-unique', type=int, default=100000)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        bench(size, args.tail_frac, args.n_unique)
+
+
+if __name__ == '__main__':
+    main()
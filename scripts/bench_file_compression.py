@@ -0,0 +1,59 @@
+"""Benchmarks the compressed read/write paths of utils.file against the uncompressed ones.
+
+usage: python -m utils.scripts.bench_file_compression [--n-records N] [--threads T]
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from utils.file import read_pickle, write_pickle, read_yaml, write_yaml
+
+
+def make_payload(n_records: int):
+    rng = np.random.default_rng(0)
+    return [dict(idx=i, name=f'design_{i}', params=rng.integers(0, 16, size=8).tolist(),
+                 metrics=dict(gain=float(rng.normal()), bw=float(rng.uniform(1e6, 1e9))))
+            for i in range(n_records)]
+
+
+def bench(name, writer, reader, fpath, obj, **kwargs):
+    t0 = time.perf_counter()
+    writer(fpath, obj, **kwargs)
+    t1 = time.perf_counter()
+    reader(fpath, threads=kwargs.get('threads', 1))
+    t2 = time.perf_counter()
+    size = fpath.stat().st_size
+    print(f'{name:<28s} size={size / 2 ** 20:8.2f} MiB  write={t1 - t0:7.3f}s  '
+          f'read={t2 - t1:7.3f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n-records', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    obj = make_payload(args.n_records)
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for fmt, writer, reader in [('pickle', write_pickle, read_pickle),
+                                    ('yaml', write_yaml, read_yaml)]:
+            if fmt == 'yaml':
+                # YAML is orders of magnitude slower, keep it to a manageable size.
+                payload = obj[:max(len(obj) // 20, 1)]
+            else:
+                payload = obj
+            for suffix in ['', '.gz', '.bz2', '.xz']:
+                fpath = tmp / f'payload.{fmt}{suffix}'
+                bench(f'{fmt}{suffix or " (none)"}', writer, reader, fpath, payload)
+                if suffix:
+                    bench(f'{fmt}{suffix} level=1', writer, reader, fpath, payload, level=1)
+                    bench(f'{fmt}{suffix} threads={args.threads}', writer, reader, fpath,
+                          payload, threads=args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Compares the hash index and the bisect lookups of ImmutableSortedDict.
+
+usage: python -m utils.scripts.bench_immutable_lookup [--sizes N [N ...]] [--number K]
+"""
+import argparse
+import timeit
+
+from utils.immutable import ImmutableSortedDict, to_immutable
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[4, 16, 64, 256, 1024])
+    parser.add_argument('--number', type=int, default=200000)
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        param = to_immutable({f'param_{i:04d}': float(i) for i in range(size)})
+        probes = [f'param_{i:04d}' for i in range(0, size, max(size // 8, 1))]
+        missing = 'param_missing'
+        for use_hash_index in (False, True):
+            ImmutableSortedDict.use_hash_index = use_hash_index
+            t_get = min(timeit.repeat(lambda: [param[k] for k in probes], number=args.number,
+                                      repeat=3))
+            t_miss = min(timeit.repeat(lambda: missing in param, number=args.number, repeat=3))
+            name = 'hash index' if use_hash_index else 'bisect'
+            print(f'n_keys={size:<6d} {name:<10s} '
+                  f'hit={t_get / args.number / len(probes) * 1e9:7.1f} ns  '
+                  f'miss={t_miss / args.number * 1e9:7.1f} ns')
+    ImmutableSortedDict.use_hash_index = True
+
+
+if __name__ == '__main__':
+    main()
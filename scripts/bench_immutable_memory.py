@@ -0,0 +1,49 @@
+"""Measures the memory footprint of Param objects created with utils.immutable.to_immutable.
+
+usage: python -m utils.scripts.bench_immutable_memory [--n N] [--vec-len L]
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+from utils.immutable import to_immutable
+
+
+def make_config(rng: random.Random, vec_len: int):
+    return dict(
+        lr=rng.random(),
+        n_layers=rng.randint(1, 8),
+        hidden=rng.choice([64, 128, 256]),
+        activation=rng.choice(['relu', 'tanh']),
+        dropout=rng.random(),
+        widths=[rng.random() for _ in range(vec_len)],
+        seeds=[rng.randint(0, 1000) for _ in range(vec_len)],
+        opt=dict(name='adam', beta1=0.9, beta2=rng.random()),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--vec-len', type=int, default=16)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    tracemalloc.start()
+    base, _ = tracemalloc.get_traced_memory()
+    configs = [make_config(rng, args.vec_len) for _ in range(args.n)]
+    params = [to_immutable(cfg) for cfg in configs]
+    # only count what the params keep alive.
+    del configs
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    nbytes = current - base
+    print(f'{len(params)} params, vector length {args.vec_len}: '
+          f'{nbytes / 2 ** 20:.1f} MiB total, {nbytes / len(params):.0f} bytes per param')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Benchmarks LoggerBase.save_records against the number of rows already saved.
+
+Rows are saved in batches of --batch records. The script reports the latency of the save that
+brings the table to each size, the latency of the next membership check (which reads the new cache
+entries), and optionally the time of an on-demand Excel export (needs openpyxl).
+
+usage: python -m utils.scripts.bench_logger_save [--sizes N [N ...]] [--batch B]
+"""
+import argparse
+import tempfile
+import time
+
+from utils.immutable import to_immutable
+from utils.log.excel_logger import LoggerBase
+
+
+def add_batch(logger: LoggerBase, start: int, n: int):
+    for i in range(start, start + n):
+        ident = to_immutable(dict(lr=i * 1e-6, arch=f'net{i % 10}', seed=i % 3))
+        logger.add_entry(f'exp{i}', ident, dict(acc=(i % 97) / 97, loss=1 / (i + 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--batch', type=int, default=10)
+    parser.add_argument('--export', action='store_true', help='also time export_excel()')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        logger = LoggerBase(root)
+        n_rows = 0
+        for size in sorted(args.sizes):
+            # fill up to just before the size, in large batches
+            while n_rows + args.batch < size:
+                n = min(10000, size - args.batch - n_rows)
+                add_batch(logger, n_rows, n)
+                logger.save_records()
+                n_rows += n
+
+            # catch the in-memory cache up with the fill, as a running experiment would have
+            to_immutable(dict(lr=0.0)) in logger
+            add_batch(logger, n_rows, args.batch)
+            t0 = time.perf_counter()
+            logger.save_records()
+            save = time.perf_counter() - t0
+            n_rows += args.batch
+
+            probe = to_immutable(dict(lr=(n_rows - 1) * 1e-6, arch=f'net{(n_rows - 1) % 10}',
+                                      seed=(n_rows - 1) % 3))
+            t0 = time.perf_counter()
+            assert probe in logger
+            contains = time.perf_counter() - t0
+            line = f'rows={n_rows:<8d} save({args.batch} rows)={save * 1e3:8.2f} ms  ' \
+                   f'contains={contains * 1e6:8.1f} us'
+
+            if args.export:
+                t0 = time.perf_counter()
+                logger.export_excel()
+                line += f'  export_excel={time.perf_counter() - t0:7.2f} s'
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmarks membership checks of utils.data.store.SQLiteDatabase against the number of entries.
+
+For every size, the store is filled in batches of unique objects, then the latency of `in` is
+measured for present objects (outside the LRU) and for absent objects (mostly answered by the
+Bloom filter). Sizes up to 100M entries take tens of GB of disk and hours to fill, so pass them
+explicitly, e.g. --sizes 1000000 10000000 100000000.
+
+usage: python -m utils.scripts.bench_store_membership [--sizes N [N ...]] [--dir DIR]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from utils.data.store import SQLiteDatabase
+
+
+def percentiles(samples, qs=(50, 99)):
+    samples = sorted(samples)
+    return [samples[min(len(samples) - 1, int(len(samples) * q / 100))] for q in qs]
+
+
+def bench(size: int, root: str, n_queries: int, batch_size: int, cache_size: int):
+    path = os.path.join(root, f'store-{size}.sqlite')
+    db = SQLiteDatabase(path, cache_size=cache_size, expected_size=size,
+                        commit_every=batch_size)
+    t0 = time.perf_counter()
+    for start in range(db.n_unique, size, batch_size):
+        db.extend([(i, 'design') for i in range(start, min(size, start + batch_size))])
+    db.commit()
+    fill = time.perf_counter() - t0
+
+    rng = random.Random(0)
+    # the first entries were evicted from the LRU long ago.
+    hits = [(rng.randrange(max(1, size - cache_size)), 'design') for _ in range(n_queries)]
+    misses = [(size + rng.randrange(size), 'design') for _ in range(n_queries)]
+    lat = {}
+    for name, queries in (('hit', hits), ('miss', misses)):
+        samples = []
+        for q in queries:
+            t = time.perf_counter()
+            q in db
+            samples.append(time.perf_counter() - t)
+        lat[name] = percentiles(samples)
+    db.close()
+
+    print(f'size={size:<11d} fill={size / fill:8.0f} adds/s  '
+          f'hit p50={lat["hit"][0] * 1e6:6.1f}us p99={lat["hit"][1] * 1e6:6.1f}us  '
+          f'miss p50={lat["miss"][0] * 1e6:6.1f}us p99={lat["miss"][1] * 1e6:6.1f}us  '
+          f'file={os.path.getsize(path) / 2 ** 20:8.1f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--dir', default=None, help='where to create the stores')
+    parser.add_argument('--n-queries', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=100000)
+    parser.add_argument('--cache-size', type=int, default=65536)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as root:
+        for size in args.sizes:
+            bench(size, root, args.n_queries, args.batch_size, args.cache_size)
+
+
+if __name__ == '__main__':
+    main()